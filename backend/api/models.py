@@ -12,6 +12,38 @@ class URLRequest(BaseModel):
         }
 
 
+class PageRangeRequest(BaseModel):
+    url: str
+    start_page: int = 1
+    end_page: Optional[int] = None
+    known_etags: Dict[int, str] = {}
+
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "url": "https://example.com/paper.pdf",
+                "start_page": 1,
+                "end_page": 10,
+                "known_etags": {"1": "3f786850e387550fdab836ed7e6dc881de23001b"},
+            }
+        }
+
+
+class ResourceRequest(BaseModel):
+    url: str
+    page_number: int
+    highlight_index: int
+
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "url": "https://example.com/paper.pdf",
+                "page_number": 1,
+                "highlight_index": 0,
+            }
+        }
+
+
 class ErrorResponse(BaseModel):
     detail: str
 
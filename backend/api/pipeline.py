@@ -0,0 +1,366 @@
+import os
+import uuid
+import socket
+import hashlib
+import asyncio
+import logging
+from tqdm import tqdm
+
+from .models import Page, Dimensions, Images
+from utils.extraction import (
+    extract_data,
+    extract_highlights,
+    format_to_html,
+    parse_highlight_mapping,
+)
+from utils.search import prepare_resources
+from utils.db import (
+    store_page,
+    check_page_exists,
+    get_ocr_pages,
+    get_stored_page_numbers,
+    store_ocr_response,
+    set_document_status,
+    set_page_status,
+    set_page_image_urls,
+    set_highlight_resources,
+    get_page_requests,
+    get_highlight_geometry,
+    set_highlight_rects,
+    set_source_hash,
+    set_page_images_ready,
+    get_pages_missing_images,
+    get_page,
+)
+from utils.singleflight import SingleFlight
+from utils.scheduler import PageQueue
+from utils.images import lookup_image_urls, ingest_images
+from utils.download import fetch_pdf
+from utils.geometry import locate_highlights_parallel
+from utils.executor import run_blocking
+
+
+logger = logging.getLogger(__name__)
+
+# Number of pages processed concurrently per document
+PAGE_CONCURRENCY = int(os.getenv("PAGE_CONCURRENCY", "4"))
+
+# Pages after a requested page that are processed ahead of the backlog
+READ_AHEAD_PAGES = int(os.getenv("READ_AHEAD_PAGES", "2"))
+
+# Identifies this process as a lease or job owner across API and worker processes
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+# Highlights whose resources are prefetched after their page is stored
+RESOURCE_PREFETCH = int(os.getenv("RESOURCE_PREFETCH", "3"))
+
+# References to running follow-up tasks (image uploads, resource prefetch)
+# so they are not garbage collected
+_followup_tasks = set()
+
+# Resource searches in flight, keyed by (url, page number, highlight index)
+_resource_flights = SingleFlight()
+
+
+async def run_ocr(url: str) -> list:
+    """
+    OCR a document and persist the result
+    Returns: List of OCR page dicts
+    """
+    await set_document_status(url, "ocr")
+    ocr_response = await extract_data(url)
+    if not ocr_response or not ocr_response.pages:
+        raise ValueError("No response received from Mistral API")
+
+    ocr_pages = [page.model_dump() for page in ocr_response.pages]
+    await store_ocr_response(url, ocr_pages)
+    return ocr_pages
+
+
+async def build_page(page: dict) -> dict:
+    """
+    Run the highlight and HTML stages for one OCR page
+    Related resources are computed per highlight on demand, see
+    get_highlight_resources, so search time never delays the page
+    Returns: Page payload ready to be stored
+    """
+    highlights = await extract_highlights(page["markdown"])
+    html, highlight_mapping = await format_to_html(page["markdown"], highlights)
+
+    # Only images already hosted under the same content hash are filled in
+    # here; the rest are uploaded by start_image_ingest once the page is stored
+    image_urls = await lookup_image_urls(page["images"])
+
+    page_images = []
+    for image in page["images"]:
+        page_images.append(
+            Images(
+                id=image["id"],
+                top_left_x=image["top_left_x"],
+                top_left_y=image["top_left_y"],
+                bottom_right_x=image["bottom_right_x"],
+                bottom_right_y=image["bottom_right_y"],
+                image_url=image_urls.get(image["id"]),
+            )
+        )
+
+    page_obj = Page(
+        index=page["index"] + 1,
+        content=f"""{html}""",
+        highlights=list(highlight_mapping.values()),
+        dimensions=Dimensions(
+            dpi=page["dimensions"]["dpi"],
+            height=page["dimensions"]["height"],
+            width=page["dimensions"]["width"],
+        ),
+        images=page_images,
+        resources={},
+    )
+    return page_obj.model_dump()
+
+
+def _track_followup(coro):
+    """
+    Run follow-up work in background, keeping a reference to the task
+    Failures are logged by the work itself and retried by the document job,
+    so the task's exception is only marked as retrieved here
+    """
+    task = asyncio.create_task(coro)
+    _followup_tasks.add(task)
+    task.add_done_callback(_followup_tasks.discard)
+    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+    return task
+
+
+async def fill_page_images(images: list, url: str, page_number: int):
+    """
+    Upload the given page images, fill their URLs into the stored page and
+    mark its images ready. Raises when any upload failed.
+    """
+    try:
+        image_urls = await ingest_images(images)
+        await set_page_image_urls(url, page_number, image_urls)
+
+        missing = [image["id"] for image in images if image["id"] not in image_urls]
+        if missing:
+            raise RuntimeError(f"Failed to host images {missing}")
+        await set_page_images_ready(url, page_number)
+    except Exception as e:
+        logger.error(f"Error uploading images of page {page_number}: {str(e)}")
+        raise
+
+
+def start_image_ingest(page: dict, url: str, final_page: dict):
+    """
+    Upload the images of a stored page that are not hosted yet, in background
+    Returns: The upload task, or None when every image is already hosted
+    """
+    pending = [
+        image
+        for image, stored in zip(page["images"], final_page["images"])
+        if not stored["image_url"] and image.get("image_base64")
+    ]
+    if pending:
+        return _track_followup(fill_page_images(pending, url, final_page["index"]))
+
+    if all(image["image_url"] for image in final_page["images"]):
+        return None
+    # The remaining images came without data, so they can never be hosted
+    return _track_followup(set_page_images_ready(url, final_page["index"]))
+
+
+async def get_highlight_resources(
+    url: str, page_number: int, highlight_index: int, sentence: str
+) -> dict:
+    """
+    Search related articles and videos for one highlight and store them
+    with the page; concurrent requests for the same highlight share a search
+    Returns: Dictionary with articles and videos
+    """
+
+    async def search():
+        resources = await prepare_resources({highlight_index: sentence})
+        await set_highlight_resources(
+            url, page_number, highlight_index, resources[highlight_index]
+        )
+        return resources[highlight_index]
+
+    return await _resource_flights.do((url, page_number, highlight_index), search)
+
+
+async def prefetch_resources(url: str, page_number: int, highlight_mapping: dict):
+    """Compute resources of the top-ranked highlights of a page"""
+    top_highlights = sorted(highlight_mapping.items())[:RESOURCE_PREFETCH]
+    results = await asyncio.gather(
+        *(
+            get_highlight_resources(url, page_number, index, sentence)
+            for index, sentence in top_highlights
+        ),
+        return_exceptions=True,
+    )
+    for result in results:
+        if isinstance(result, Exception):
+            logger.error(f"Error prefetching resources of page {page_number}: {result}")
+
+
+def start_resource_prefetch(url: str, final_page: dict):
+    """
+    Prefetch resources of the top highlights of a stored page in background
+    Returns: The prefetch task, or None when there is nothing to prefetch
+    """
+    highlight_mapping = parse_highlight_mapping(final_page["content"])
+    if RESOURCE_PREFETCH <= 0 or not highlight_mapping:
+        return None
+
+    return _track_followup(prefetch_resources(url, final_page["index"], highlight_mapping))
+
+
+async def process_single_page(
+    page: dict, url: str, total_pages: int, followup_tasks: list = None
+) -> bool:
+    """
+    Process a single page and store it in the database
+    Image uploads and resource prefetch started for the page are appended
+    to followup_tasks
+    Returns: bool indicating if the page is stored
+    """
+    page_number = page["index"] + 1
+
+    # Skip if page already exists
+    if await check_page_exists(url, page_number):
+        return True
+
+    try:
+        final_page = await build_page(page)
+        await store_page(url, page_number, final_page, total_pages)
+        tasks = [
+            start_image_ingest(page, url, final_page),
+            start_resource_prefetch(url, final_page),
+        ]
+        if followup_tasks is not None:
+            followup_tasks.extend(task for task in tasks if task)
+        return True
+    except Exception as e:
+        logger.error(f"Error processing page {page_number}: {str(e)}")
+        await set_page_status(url, page_number, "failed", error=str(e))
+        return False
+
+
+async def compute_highlight_geometry(url: str):
+    """
+    Locate the highlights of every stored page in the PDF text layer and
+    store their rectangles, so annotating the PDF needs no text search
+    Pages whose stored geometry matches their current highlights and the
+    fetched file are skipped
+    """
+    geometry = await get_highlight_geometry(url)
+    stale = {
+        page_num: page["highlights"]
+        for page_num, page in geometry.items()
+        if page["rects"] is None and page["highlights"]
+    }
+    if not stale:
+        return
+
+    pdf_bytes = await run_blocking(fetch_pdf, url)
+    source_hash = hashlib.sha256(pdf_bytes).hexdigest()
+    await set_source_hash(url, source_hash)
+
+    # Rectangles located in an earlier version of the file are stale too
+    geometry = await get_highlight_geometry(url, source_hash)
+    stale = {
+        page_num: page["highlights"]
+        for page_num, page in geometry.items()
+        if page["rects"] is None and page["highlights"]
+    }
+    located = await run_blocking(locate_highlights_parallel, pdf_bytes, stale)
+    for page_num, rects in located.items():
+        await set_highlight_rects(url, page_num + 1, stale[page_num], rects, source_hash)
+
+
+async def process_document(url: str):
+    """
+    Process every page of a document that is not stored yet.
+    OCR output is reused when present, so a restarted job resumes from the
+    pages already stored. PAGE_CONCURRENCY workers pull pages from a priority
+    queue so pages readers are waiting for (and a read-ahead window after
+    them) jump the backlog; provider calls inside each page are bounded
+    separately in utils.providers.
+    Raises when any page failed so the job is retried for the missing pages.
+    """
+    ocr_pages = await get_ocr_pages(url)
+    if not ocr_pages:
+        ocr_pages = await run_ocr(url)
+
+    total_pages = len(ocr_pages)
+    await set_document_status(url, "processing", total_pages=total_pages)
+
+    stored = set(await get_stored_page_numbers(url))
+    pages_by_number = {
+        page["index"] + 1: page
+        for page in ocr_pages
+        if page["index"] + 1 not in stored
+    }
+    queue = PageQueue(pages_by_number, READ_AHEAD_PAGES)
+    last_request_at = None
+    failed_pages = []
+    followup_tasks = []
+
+    # Stored pages whose image uploads failed or never finished (e.g. the
+    # process stopped) are uploaded again as part of this job
+    ocr_by_number = {page["index"] + 1: page for page in ocr_pages}
+    for page_number in await get_pages_missing_images(url):
+        if page_number in pages_by_number or page_number not in ocr_by_number:
+            continue
+        record, _ = await get_page(url, page_number)
+        if record:
+            task = start_image_ingest(ocr_by_number[page_number], url, record["page_data"])
+            if task:
+                followup_tasks.append(task)
+
+    async def apply_page_requests():
+        # Requests may land on any API worker, so they are read back
+        # from the document record before each page is picked
+        nonlocal last_request_at
+        for page_request in await get_page_requests(url):
+            if last_request_at and page_request["requested_at"] <= last_request_at:
+                continue
+            queue.prioritize(page_request["page_number"])
+            last_request_at = page_request["requested_at"]
+
+    with tqdm(total=len(pages_by_number), desc="Processing remaining pages") as progress:
+
+        async def worker():
+            while True:
+                await apply_page_requests()
+                page_number = queue.pop()
+                if page_number is None:
+                    return
+                # process_single_page logs its own failures, so one bad
+                # page never stops the others
+                if not await process_single_page(
+                    pages_by_number[page_number], url, total_pages, followup_tasks
+                ):
+                    failed_pages.append(page_number)
+                progress.update(1)
+
+        await asyncio.gather(*(worker() for _ in range(PAGE_CONCURRENCY)))
+
+    # The job is only done once the images of its pages are hosted and
+    # their top resources prefetched; failed uploads fail the job so it is
+    # retried
+    results = await asyncio.gather(*followup_tasks, return_exceptions=True)
+    followup_errors = [result for result in results if isinstance(result, Exception)]
+
+    if failed_pages:
+        raise RuntimeError(f"Failed to process pages {sorted(failed_pages)}")
+    if followup_errors:
+        raise RuntimeError(f"Failed to host page images: {followup_errors[0]}")
+
+    # Missing geometry only means the download searches for those pages
+    try:
+        await compute_highlight_geometry(url)
+    except Exception as e:
+        logger.warning(f"Could not compute highlight geometry for {url}: {str(e)}")
+
+    await set_document_status(url, "completed")
@@ -1,29 +1,67 @@
 import os
-import uuid
+import re
+import json
+import time
+import hashlib
 import tempfile
 import asyncio
 import logging
-from tqdm import tqdm
 from copy import deepcopy
+from typing import Optional
 
-from fastapi.responses import JSONResponse
-from fastapi import APIRouter, HTTPException, BackgroundTasks
-from urllib.parse import urlparse
+import requests
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Request
+from urllib.parse import quote, urlparse
 from .models import (
     URLRequest,
+    PageRangeRequest,
+    ResourceRequest,
     HealthCheck,
     ErrorResponse,
     APIResponse,
-    Page,
-    Dimensions,
-    Images,
     DownloadPDFRequest,
 )
-from utils.extraction import extract_data, extract_highlights, format_to_html
-from utils.search import prepare_resources
-from utils.db import store_page, get_page, check_page_exists, get_highlights
+from .pipeline import (
+    WORKER_ID,
+    run_ocr,
+    build_page,
+    start_image_ingest,
+    start_resource_prefetch,
+    get_highlight_resources,
+)
+from utils.extraction import parse_highlight_mapping
+from utils.db import (
+    store_page,
+    get_page,
+    check_page_exists,
+    get_highlight_geometry,
+    annotated_pdf_key,
+    get_annotated_pdf,
+    store_annotated_pdf,
+    get_source_hash,
+    set_source_hash,
+    get_pages,
+    get_stored_page_numbers,
+    get_stored_total_pages,
+    get_document_id,
+    get_ocr_pages,
+    set_document_status,
+    get_document,
+    pages_finalized,
+    acquire_lease,
+    renew_lease,
+    release_lease,
+    request_page,
+)
+from utils.jobs import enqueue_job, get_job
+from utils.singleflight import SingleFlight
+from utils.events import page_events
+from utils.cache import MISSING, LRUCache, cache_stats
+from utils.providers import provider_stats
 from utils.cloudinary_utils import init_cloudinary, upload_to_cloudinary
-from utils.download import download_and_highlight_pdf
+from utils.download import download_and_highlight_pdf, fetch_pdf
+from utils.executor import run_blocking
 
 
 # Configure logging
@@ -34,6 +72,35 @@ logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+# Seconds a document processing lease stays valid without renewal
+LEASE_SECONDS = int(os.getenv("DOCUMENT_LEASE_SECONDS", "120"))
+
+# Most pages returned by one page range request
+MAX_PAGE_RANGE = int(os.getenv("MAX_PAGE_RANGE", "50"))
+
+# Seconds between database checks of a page stream, for pages stored by
+# other processes
+STREAM_POLL_INTERVAL = float(os.getenv("STREAM_POLL_INTERVAL", "1"))
+
+# Seconds between keep-alive comments on an idle page stream
+STREAM_KEEPALIVE = 15
+
+# Seconds a stream waits for a document that was never submitted
+STREAM_UNKNOWN_TIMEOUT = float(os.getenv("STREAM_UNKNOWN_TIMEOUT", "60"))
+
+# In-flight document pipelines of this process, keyed by document id
+document_flights = SingleFlight()
+
+# Annotated PDFs being built in this process, keyed by document URL
+pdf_flights = SingleFlight()
+
+# Recently built annotated PDFs, so the range requests of a PDF viewer are
+# served without rebuilding the file
+ANNOTATED_PDFS = LRUCache(
+    maxsize=int(os.getenv("ANNOTATED_PDF_CACHE_SIZE", "8")),
+    ttl=int(os.getenv("ANNOTATED_PDF_CACHE_TTL", "600")),
+)
+
 # Initialize Cloudinary
 init_cloudinary()
 
@@ -49,65 +116,88 @@ async def root():
     return HealthCheck(status="ok", message="Welcome to SmartRead API")
 
 
-async def process_single_page(page, url: str, total_pages: int) -> None:
-    """Process a single page and store it in the database"""
-    page_number = page.index + 1
+@router.get(
+    "/api/cache/stats",
+    response_model=APIResponse,
+    tags=["Health"],
+    summary="Cache Statistics",
+    description="Hit/miss counters of the result caches in this process",
+)
+async def get_cache_stats():
+    return {
+        "status": "success",
+        "message": "Cache statistics retrieved",
+        "data": cache_stats(),
+    }
 
-    # Skip if page already exists
-    if check_page_exists(url, page_number):
-        return
 
+@router.get(
+    "/api/providers/stats",
+    response_model=APIResponse,
+    tags=["Health"],
+    summary="Provider Statistics",
+    description="Call, retry and throttling counters of the external providers in this process",
+)
+async def get_provider_stats():
+    return {
+        "status": "success",
+        "message": "Provider statistics retrieved",
+        "data": provider_stats(),
+    }
+
+
+async def keep_lease(url: str):
+    """Renew the document lease until cancelled"""
+    while True:
+        await asyncio.sleep(LEASE_SECONDS / 3)
+        if not await renew_lease(url, WORKER_ID, LEASE_SECONDS):
+            logger.warning(f"Lost processing lease for {url}")
+            return
+
+
+async def start_document(url: str, page_number: int):
+    """
+    Start a document under its processing lease: OCR (unless already stored)
+    and the requested page inline, then queue a job for the remaining pages.
+    Returns: (total_pages, ready_page) or None when another worker holds the lease
+    """
+    if not await acquire_lease(url, WORKER_ID, LEASE_SECONDS):
+        return None
+
+    heartbeat = asyncio.create_task(keep_lease(url))
     try:
-        highlights = extract_highlights(page.markdown)
-        html, highlight_mapping = format_to_html(page.markdown, highlights)
-        resources = prepare_resources(highlight_mapping)
-
-        page_images = []
-        for image in page.images:
-            image_uuid = str(uuid.uuid4())
-            cloudinary_img_url = upload_to_cloudinary(
-                image.image_base64,
-                f"url_{url}_page_{page.index}_image_{image_uuid}",
-            )
-            page_images.append(
-                Images(
-                    id=image.id,
-                    top_left_x=image.top_left_x,
-                    top_left_y=image.top_left_y,
-                    bottom_right_x=image.bottom_right_x,
-                    bottom_right_y=image.bottom_right_y,
-                    image_url=cloudinary_img_url,
-                )
-            )
-
-        page_obj = Page(
-            index=page_number,
-            content=f"""{html}""",
-            highlights=list(highlight_mapping.values()),
-            dimensions=Dimensions(
-                dpi=page.dimensions.dpi,
-                height=page.dimensions.height,
-                width=page.dimensions.width,
-            ),
-            images=page_images,
-            resources=resources,
-        )
-        final_page = page_obj.model_dump()
-        store_page(url, page_number, final_page, total_pages)
+        ocr_pages = await get_ocr_pages(url)
+        if not ocr_pages:
+            ocr_pages = await run_ocr(url)
+
+        total_pages = len(ocr_pages)
+        await set_document_status(url, "processing", total_pages=total_pages)
+
+        # Process the requested page immediately, wherever it is in the document
+        ready_page = None
+        requested = [page for page in ocr_pages if page["index"] + 1 == page_number]
+        if requested and not await check_page_exists(url, page_number):
+            final_page = await build_page(requested[0])
+            ready_page = deepcopy(final_page)
+            await store_page(url, page_number, final_page, total_pages)
+            # New images are hosted in background and reach the reader
+            # through the page stream
+            start_image_ingest(requested[0], url, final_page)
+            start_resource_prefetch(url, final_page)
+
+        # Let the read-ahead window after the requested page go first
+        await request_page(url, page_number)
+
+        # Remaining pages are processed by the worker processes
+        await enqueue_job(url, requeue=True)
     except Exception as e:
-        logger.error(f"Error processing page {page_number}: {str(e)}")
+        await set_document_status(url, "failed", error=str(e))
+        raise
+    finally:
+        heartbeat.cancel()
+        await release_lease(url, WORKER_ID)
 
-
-def process_remaining_pages(ocr_response, url, total_pages):
-    """Background task to process remaining pages starting from page 2 sequentially"""
-    try:
-        # Process remaining pages sequentially
-        for page in tqdm(ocr_response.pages[1:], desc="Processing remaining pages"):
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            loop.run_until_complete(process_single_page(page, url, total_pages))
-    except Exception as e:
-        logger.error(f"Error in background task: {str(e)}")
+    return total_pages, ready_page
 
 
 @router.post(
@@ -123,10 +213,10 @@ def process_remaining_pages(ocr_response, url, total_pages):
     summary="Extract Text from Image",
     description="Process an image from a given URL using Mistral OCR to extract text",
 )
-async def extract_from_url(request: URLRequest, background_tasks: BackgroundTasks):
+async def extract_from_url(request: URLRequest):
     try:
         # Check if page already exists
-        existing_page, total_pages = get_page(request.url, request.page_number)
+        existing_page, total_pages = await get_page(request.url, request.page_number)
 
         if existing_page:
             return {
@@ -135,6 +225,7 @@ async def extract_from_url(request: URLRequest, background_tasks: BackgroundTask
                 "data": {
                     "total_pages": total_pages,
                     "page": existing_page["page_data"],
+                    "etag": existing_page["etag"],
                 },
             }
 
@@ -145,84 +236,533 @@ async def extract_from_url(request: URLRequest, background_tasks: BackgroundTask
         except Exception:
             raise HTTPException(status_code=400, detail="Invalid URL provided")
 
-        ocr_response = extract_data(request.url)
-        if not ocr_response or not ocr_response.pages:
-            raise HTTPException(
-                status_code=500, detail="No response received from Mistral API"
+        job = await get_job(request.url)
+        if job is None:
+            # Concurrent requests for the same document share one start;
+            # across workers the Mongo lease makes sure only one of them runs it
+            outcome = await document_flights.do(
+                get_document_id(request.url),
+                lambda: start_document(request.url, request.page_number),
             )
 
-        # Process first page immediately if it's the requested page
-        first_page = ocr_response.pages[0]
-        first_page_number = first_page.index + 1
-
-        if request.page_number == first_page_number:
-            highlights = extract_highlights(first_page.markdown)
-            html, highlight_mapping = format_to_html(first_page.markdown, highlights)
-            resources = prepare_resources(highlight_mapping)
-
-            page_images = []
-            for image in first_page.images:
-                image_uuid = str(uuid.uuid4())
-                cloudinary_img_url = upload_to_cloudinary(
-                    image.image_base64,
-                    f"url_{request.url}_page_{first_page.index}_image_{image_uuid}",
-                )
-                page_images.append(
-                    Images(
-                        id=image.id,
-                        top_left_x=image.top_left_x,
-                        top_left_y=image.top_left_y,
-                        bottom_right_x=image.bottom_right_x,
-                        bottom_right_y=image.bottom_right_y,
-                        image_url=cloudinary_img_url,
-                    )
-                )
-
-            page_obj = Page(
-                index=first_page_number,
-                content=f"""{html}""",
-                highlights=list(highlight_mapping.values()),
-                dimensions=Dimensions(
-                    dpi=first_page.dimensions.dpi,
-                    height=first_page.dimensions.height,
-                    width=first_page.dimensions.width,
-                ),
-                images=page_images,
-                resources=resources,
-            )
-            final_page = page_obj.model_dump()
-            response_page = deepcopy(final_page)
-            store_page(
-                request.url, first_page_number, final_page, len(ocr_response.pages)
+            if outcome is not None:
+                total_pages, ready_page = outcome
+                if ready_page and ready_page["index"] == request.page_number:
+                    return {
+                        "status": "success",
+                        "message": "Page processed successfully",
+                        "data": {"total_pages": total_pages, "page": ready_page},
+                    }
+
+        document = await get_document(request.url) or {}
+        total_pages = document.get("total_pages")
+        if request.page_number < 1 or (total_pages and request.page_number > total_pages):
+            raise HTTPException(
+                status_code=400,
+                detail=f"Page {request.page_number} is out of range"
+                + (f", the document has {total_pages} pages" if total_pages else ""),
             )
 
-            # Schedule remaining pages for background processing
-            if len(ocr_response.pages) > 1:
-                background_tasks.add_task(
-                    process_remaining_pages,
-                    ocr_response,
-                    request.url,
-                    len(ocr_response.pages),
-                )
-
-            return {
-                "status": "success",
-                "message": "Page processed successfully",
-                "data": {"total_pages": len(ocr_response.pages), "page": response_page},
-            }
+        page_status = document.get("page_status", {}).get(str(request.page_number), {})
+        if job and job["status"] in ("done", "failed") and page_status.get("status") == "failed":
+            # The job gave up on this page, give it another round
+            await enqueue_job(request.url, requeue=True)
 
+        # The OCR output is persisted, so pages that are not ready yet
+        # only need a status lookup and a nudge to the scheduler, never
+        # another OCR run
+        await request_page(request.url, request.page_number)
         return JSONResponse(
             status_code=202,
             content={
                 "status": "processing",
                 "message": f"Page {request.page_number} is being processed",
-                "data": {"total_pages": len(ocr_response.pages)},
+                "data": {
+                    "total_pages": total_pages,
+                    "job_status": document.get("status"),
+                },
             },
         )
 
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get(
+    "/api/jobs/status",
+    response_model=APIResponse,
+    responses={
+        200: {"description": "Processing status of the document"},
+        404: {"model": ErrorResponse, "description": "Document was never submitted"},
+    },
+    tags=["OCR"],
+    summary="Document Processing Status",
+    description="Get the job state and page progress of a document",
+)
+async def job_status(url: str):
+    job = await get_job(url)
+    document = await get_document(url)
+    if not job and not document:
+        raise HTTPException(status_code=404, detail="Document not found")
+
+    job = job or {}
+    document = document or {}
+    page_status = document.get("page_status", {})
+    return {
+        "status": "success",
+        "message": "Job status retrieved",
+        "data": {
+            "job_status": job.get("status"),
+            "attempts": job.get("attempts", 0),
+            "error": job.get("error") or document.get("error"),
+            "document_status": document.get("status"),
+            "total_pages": document.get("total_pages"),
+            "ready_pages": sorted(
+                int(number)
+                for number, page in page_status.items()
+                if page["status"] == "ready"
+            ),
+            "failed_pages": sorted(
+                int(number)
+                for number, page in page_status.items()
+                if page["status"] == "failed"
+            ),
+        },
+    }
+
+
+@router.post(
+    "/api/pages",
+    response_model=APIResponse,
+    responses={
+        200: {"description": "Ready pages of the range and status of the rest"},
+        400: {"model": ErrorResponse, "description": "Invalid page range"},
+        404: {"model": ErrorResponse, "description": "Document was never submitted"},
+    },
+    tags=["OCR"],
+    summary="Get Page Range",
+    description="Retrieve a range of processed pages in one round trip, skipping pages the client already has",
+)
+async def get_pages_in_range(request: PageRangeRequest):
+    document = await get_document(request.url)
+    if document:
+        total_pages = document.get("total_pages")
+        page_status = document.get("page_status", {})
+        stored_pages = {
+            int(number) for number, page in page_status.items() if page["status"] == "ready"
+        }
+    else:
+        # Documents processed before the manifest only have their pages
+        total_pages = await get_stored_total_pages(request.url)
+        if total_pages is None:
+            raise HTTPException(status_code=404, detail="Document not found")
+        document, page_status = {}, {}
+        stored_pages = set(await get_stored_page_numbers(request.url))
+
+    end_page = request.end_page or total_pages or request.start_page
+    if total_pages:
+        end_page = min(end_page, total_pages)
+    if request.start_page < 1 or end_page < request.start_page:
+        raise HTTPException(status_code=400, detail="Invalid page range")
+    if end_page - request.start_page + 1 > MAX_PAGE_RANGE:
+        raise HTTPException(
+            status_code=400, detail=f"At most {MAX_PAGE_RANGE} pages per request"
+        )
+
+    # Pages never change number, so a known, stored page missing from the
+    # result is one whose etag still matches
+    pages = await get_pages(
+        request.url, request.known_etags, request.start_page, end_page
+    )
+    returned = {page["page_number"] for page in pages}
+    page_range = range(request.start_page, end_page + 1)
+    not_modified = [
+        number
+        for number in page_range
+        if number in request.known_etags
+        and number not in returned
+        and number in stored_pages
+    ]
+
+    pending = {
+        number: page_status.get(str(number), {}).get("status", "processing")
+        for number in page_range
+        if number not in returned and number not in not_modified
+    }
+
+    return {
+        "status": "success",
+        "message": f"Retrieved {len(pages)} pages",
+        "data": {
+            "total_pages": total_pages,
+            "job_status": document.get("status"),
+            "pages": [
+                {"page": page["page_data"], "etag": page["etag"]} for page in pages
+            ],
+            "not_modified": not_modified,
+            "pending": pending,
+        },
+    }
+
+
+@router.post(
+    "/api/resources",
+    response_model=APIResponse,
+    responses={
+        200: {"description": "Related articles and videos of the highlight"},
+        404: {"model": ErrorResponse, "description": "Page or highlight not found"},
+        500: {"model": ErrorResponse, "description": "Internal server error"},
+    },
+    tags=["OCR"],
+    summary="Get Highlight Resources",
+    description="Find related articles and videos for one highlight of a page, computed on first request",
+)
+async def get_resources(request: ResourceRequest):
+    existing_page, _ = await get_page(request.url, request.page_number)
+    if not existing_page:
+        raise HTTPException(status_code=404, detail="Page not found")
+
+    page_data = existing_page["page_data"]
+    cached = page_data.get("resources", {}).get(str(request.highlight_index))
+    if cached:
+        return {
+            "status": "success",
+            "message": "Retrieved from cache",
+            "data": {"highlight_index": request.highlight_index, "resources": cached},
+        }
+
+    highlight_mapping = parse_highlight_mapping(page_data["content"])
+    sentence = highlight_mapping.get(request.highlight_index)
+    if sentence is None:
+        raise HTTPException(status_code=404, detail="Highlight not found")
+
+    try:
+        resources = await get_highlight_resources(
+            request.url, request.page_number, request.highlight_index, sentence
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+    return {
+        "status": "success",
+        "message": "Resources retrieved",
+        "data": {"highlight_index": request.highlight_index, "resources": resources},
+    }
+
+
+def format_event(event: str, data: dict) -> str:
+    """Encode a server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def page_stream(url: str):
+    """
+    Yield every stored page of a document as a server-sent event, followed
+    by progress updates, until all pages are sent or processing failed
+    """
+    document_id = get_document_id(url)
+    # Page number -> etag of the version sent, so updated pages are sent again
+    sent_pages = {}
+    last_progress = None
+    last_message_at = opened_at = time.monotonic()
+    notified = page_events.subscribe(document_id)
+
+    try:
+        while True:
+            notified.clear()
+            document = await get_document(url) or {}
+            total_pages = document.get("total_pages")
+
+            for page in await get_pages(url, sent_pages):
+                sent_pages[page["page_number"]] = page["etag"]
+                yield format_event(
+                    "page",
+                    {
+                        "total_pages": total_pages,
+                        "page": page["page_data"],
+                        "etag": page["etag"],
+                    },
+                )
+                last_message_at = time.monotonic()
+
+            progress = {
+                "total_pages": total_pages,
+                "ready_pages": len(sent_pages),
+                "job_status": document.get("status"),
+            }
+            if progress != last_progress:
+                yield format_event("progress", progress)
+                last_progress = progress
+                last_message_at = time.monotonic()
+
+            # Pages are final once their images are hosted; until then an
+            # image upload can still change a page that was already sent
+            if (
+                total_pages
+                and len(sent_pages) >= total_pages
+                and pages_finalized(document)
+            ):
+                yield format_event("done", progress)
+                return
+
+            job = await get_job(url)
+            if job and job["status"] == "failed":
+                yield format_event("failed", {"detail": job.get("error")})
+                return
+            # OCR failures mark the document before any job exists
+            if document.get("status") == "failed" and not job:
+                yield format_event("failed", {"detail": document.get("error")})
+                return
+
+            if not document and not job and time.monotonic() - opened_at >= STREAM_UNKNOWN_TIMEOUT:
+                # Documents stored before the manifest have pages but no record
+                if sent_pages:
+                    yield format_event("done", progress)
+                else:
+                    yield format_event("failed", {"detail": "Document not found"})
+                return
+
+            if time.monotonic() - last_message_at >= STREAM_KEEPALIVE:
+                yield ": keep-alive\n\n"
+                last_message_at = time.monotonic()
+
+            try:
+                await asyncio.wait_for(notified.wait(), STREAM_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        page_events.unsubscribe(document_id, notified)
+
+
+@router.get(
+    "/api/extract/stream",
+    responses={
+        200: {"description": "Stream of processed pages as server-sent events"},
+    },
+    tags=["OCR"],
+    summary="Stream Processed Pages",
+    description="Push each page of a document and progress counts as soon as they are stored",
+)
+async def stream_pages(url: str, page_number: Optional[int] = None):
+    # The stream may open before the first extract request has registered
+    # the document, so an unknown URL simply waits for its pages.
+    # Let the page the reader is looking at go first
+    if page_number:
+        await request_page(url, page_number)
+
+    return StreamingResponse(
+        page_stream(url),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def build_annotated_pdf(
+    url: str, geometry: Optional[dict] = None, source_hash: Optional[str] = None
+):
+    """
+    Highlight a document's PDF, reusing a recent build from this process
+    when the source file and every page's highlights are unchanged
+    Returns: (cache key, original filename, annotated PDF bytes)
+    """
+    if geometry is None:
+        geometry = await get_highlight_geometry(url)
+        source_hash = await get_source_hash(url)
+
+    if source_hash:
+        key = annotated_pdf_key(source_hash, geometry)
+        built = ANNOTATED_PDFS.get(key)
+        if built is not MISSING:
+            return (key, *built)
+
+    # Fetch the source to annotate it and to check whether it changed
+    try:
+        pdf_bytes = await run_blocking(fetch_pdf, url)
+    except requests.RequestException:
+        raise HTTPException(status_code=400, detail="Failed to download PDF")
+
+    fetched_hash = hashlib.sha256(pdf_bytes).hexdigest()
+    key = annotated_pdf_key(fetched_hash, geometry)
+    if fetched_hash != source_hash:
+        await set_source_hash(url, fetched_hash)
+        # Rectangles located in the previous file would land in the wrong
+        # place; pages without them are searched in this one
+        geometry = await get_highlight_geometry(url, fetched_hash)
+        built = ANNOTATED_PDFS.get(key)
+        if built is not MISSING:
+            return (key, *built)
+
+    # A directory per request, so concurrent downloads of PDFs with the
+    # same name never share files
+    with tempfile.TemporaryDirectory() as temp_dir:
+        success, original_filename, highlighted_pdf_path = await run_blocking(
+            download_and_highlight_pdf, url, geometry, temp_dir, pdf_bytes
+        )
+        if not success:
+            raise HTTPException(status_code=400, detail="Failed to download PDF")
+
+        with open(highlighted_pdf_path, "rb") as pdf_file:
+            annotated = pdf_file.read()
+
+    ANNOTATED_PDFS.set(key, (original_filename, annotated))
+    return key, original_filename, annotated
+
+
+async def host_annotated_pdf(url: str, key: str, original_filename: str, annotated: bytes):
+    """
+    Upload an annotated PDF to Cloudinary and register it under its key
+    Returns: Hosted PDF URL or None
+    """
+    # The key keeps versions of the same file apart, since existing public
+    # ids are never overwritten
+    pdf_url = await upload_to_cloudinary(
+        annotated,
+        f"{'_'.join(original_filename.split('.')[:-1])}_{key[:12]}",
+        type="pdf",
+    )
+    if pdf_url:
+        await store_annotated_pdf(key, url, pdf_url)
+    return pdf_url
+
+
+async def annotate_pdf(url: str) -> Optional[str]:
+    """
+    Highlight a document's PDF and host it, reusing the hosted copy when the
+    source file and every page's highlights are unchanged
+    Returns: Hosted PDF URL
+    """
+    geometry = await get_highlight_geometry(url)
+
+    source_hash = await get_source_hash(url)
+    if source_hash:
+        pdf_url = await get_annotated_pdf(annotated_pdf_key(source_hash, geometry))
+        if pdf_url:
+            return pdf_url
+
+    key, original_filename, annotated = await pdf_flights.do(
+        f"build:{url}", lambda: build_annotated_pdf(url, geometry, source_hash)
+    )
+
+    # The source may have changed back to a version that is already hosted
+    pdf_url = await get_annotated_pdf(key)
+    if pdf_url:
+        return pdf_url
+    return await host_annotated_pdf(url, key, original_filename, annotated)
+
+
+class UnsatisfiableRange(Exception):
+    """A valid byte range that lies outside the file"""
+
+
+def parse_range(range_header: str, size: int):
+    """
+    Parse a single-range Range header. Headers asking for several ranges,
+    or that are malformed, are ignored so the whole file is sent.
+    Returns: (start, end) inclusive, or None to ignore the header
+    Raises: UnsatisfiableRange when the range can't be satisfied
+    """
+    match = re.fullmatch(r"\s*bytes=(\d*)-(\d*)\s*", range_header)
+    if not match or not (match.group(1) or match.group(2)):
+        return None
+
+    if not match.group(1):
+        # Suffix range: the last N bytes
+        length = int(match.group(2))
+        if length == 0:
+            raise UnsatisfiableRange(range_header)
+        return max(0, size - length), size - 1
+
+    start = int(match.group(1))
+    end = int(match.group(2)) if match.group(2) else size - 1
+    if match.group(2) and end < start:
+        return None
+    if start >= size:
+        raise UnsatisfiableRange(range_header)
+    return start, min(end, size - 1)
+
+
+def iter_chunks(data: bytes, chunk_size: int = 64 * 1024):
+    """Yield data in chunks without copying it"""
+    view = memoryview(data)
+    for offset in range(0, len(view), chunk_size):
+        yield view[offset : offset + chunk_size]
+
+
+@router.get(
+    "/pdf/download/stream",
+    responses={
+        200: {"content": {"application/pdf": {}}, "description": "The highlighted PDF"},
+        206: {"content": {"application/pdf": {}}, "description": "Part of the highlighted PDF"},
+        400: {"model": ErrorResponse, "description": "Failed to download PDF"},
+        416: {"description": "Requested range not satisfiable"},
+    },
+    tags=["PDF"],
+    summary="Stream Highlighted PDF",
+    description=(
+        "Stream the highlighted PDF straight back, with byte-range support. "
+        "With upload=true it is also hosted on Cloudinary in the background "
+        "for later /pdf/download calls."
+    ),
+)
+async def stream_pdf(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    url: str,
+    download: bool = False,
+    upload: bool = False,
+):
+    try:
+        key, original_filename, annotated = await pdf_flights.do(
+            f"build:{url}", lambda: build_annotated_pdf(url)
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    if upload and not await get_annotated_pdf(key):
+        background_tasks.add_task(host_annotated_pdf, url, key, original_filename, annotated)
+
+    filename = f"highlighted_{original_filename}"
+    ascii_filename = filename.encode("ascii", "ignore").decode().replace('"', "")
+    disposition = "attachment" if download else "inline"
+    size = len(annotated)
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Content-Disposition": (
+            f'{disposition}; filename="{ascii_filename}"; '
+            f"filename*=UTF-8''{quote(filename)}"
+        ),
+        "ETag": f'"{key}"',
+    }
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    byte_range = None
+    if range_header and (not if_range or if_range == headers["ETag"]):
+        try:
+            byte_range = parse_range(range_header, size)
+        except UnsatisfiableRange:
+            return Response(status_code=416, headers={"Content-Range": f"bytes */{size}"})
+
+    if byte_range is not None:
+        start, end = byte_range
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        headers["Content-Length"] = str(end - start + 1)
+        return StreamingResponse(
+            iter_chunks(annotated[start : end + 1]),
+            status_code=206,
+            media_type="application/pdf",
+            headers=headers,
+        )
+
+    headers["Content-Length"] = str(size)
+    return StreamingResponse(
+        iter_chunks(annotated), media_type="application/pdf", headers=headers
+    )
+
 
 @router.post(
     "/pdf/download",
@@ -238,30 +778,15 @@ async def extract_from_url(request: URLRequest, background_tasks: BackgroundTask
 )
 async def download_pdf(request: DownloadPDFRequest):
     try:
-        highlights = get_highlights(request.pdf_url)
-        # Create a temporary directory to work with files
-        with tempfile.TemporaryDirectory() as temp_dir:
-            original_pdf_path = os.path.join(temp_dir, "original.pdf")
-            with open(original_pdf_path, "wb") as _:
-                success, original_filename, highlighted_pdf_path = (
-                    download_and_highlight_pdf(request.pdf_url, highlights)
-                )
-                if not success:
-                    raise HTTPException(
-                        status_code=400, detail="Failed to download PDF"
-                    )
-
-            # Upload to Cloudinary
-            pdf_url = upload_to_cloudinary(
-                highlighted_pdf_path,
-                f"{'_'.join(original_filename.split('.')[:-1])}",
-                type="pdf",
-            )
-
-            return {
-                "status": "success",
-                "message": "PDF Ready",
-                "data": {"pdf_url": pdf_url},
-            }
+        pdf_url = await pdf_flights.do(
+            request.pdf_url, lambda: annotate_pdf(request.pdf_url)
+        )
+        return {
+            "status": "success",
+            "message": "PDF Ready",
+            "data": {"pdf_url": pdf_url},
+        }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -1,16 +1,44 @@
 import os
+import asyncio
 import uvicorn
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 
+# Load environment variables before the modules below read them; the
+# database handle is created when utils.db is imported
+load_dotenv()
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 
 from api.routes import router
 from api.swagger import custom_openapi
+from utils.http_client import close_http_client
+from utils.executor import shutdown_executors
+from utils.db import ensure_indexes
+from utils.jobs import ensure_job_indexes
+from worker import run_worker
 
-# Load environment variables
-load_dotenv()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await ensure_indexes()
+    await ensure_job_indexes()
+
+    # Single-container deployments process jobs inside the API process;
+    # set EMBEDDED_WORKER=false and run `python worker.py` to scale separately
+    worker_task = None
+    if os.getenv("EMBEDDED_WORKER", "true").lower() == "true":
+        worker_task = asyncio.create_task(run_worker())
+
+    yield
+
+    if worker_task:
+        worker_task.cancel()
+    # Release pooled connections held by the shared HTTP client
+    await close_http_client()
+    shutdown_executors()
 
 
 def get_application() -> FastAPI:
@@ -20,6 +48,7 @@ def get_application() -> FastAPI:
         version="1.0.0",
         docs_url="/docs",
         redoc_url="/redoc",
+        lifespan=lifespan,
     )
 
     # Configure CORS with more permissive settings for development
@@ -0,0 +1,139 @@
+import re
+from html.parser import HTMLParser
+
+from utils.render import inject_highlights, render_inline, render_markdown, render_page
+
+
+class _TagChecker(HTMLParser):
+    """Collect open/close mismatches of rendered HTML"""
+
+    VOID = {"img", "hr", "br"}
+
+    def __init__(self):
+        super().__init__()
+        self.stack = []
+        self.errors = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag not in self.VOID:
+            self.stack.append(tag)
+
+    def handle_endtag(self, tag):
+        if not self.stack or self.stack[-1] != tag:
+            self.errors.append(f"unexpected </{tag}>, open: {self.stack}")
+        else:
+            self.stack.pop()
+
+
+def assert_well_formed(html: str):
+    checker = _TagChecker()
+    checker.feed(html)
+    assert not checker.errors
+    assert not checker.stack
+
+
+def test_text_is_escaped():
+    assert render_inline("a < b & <script>") == "a &lt; b &amp; &lt;script&gt;"
+
+
+def test_image_alt_cannot_add_attributes():
+    html = render_inline('![x" onerror="alert(1)](y.png)')
+    assert html == '<img src="y.png" alt="x&quot; onerror=&quot;alert(1)">'
+
+
+def test_link_keeps_query_string_escaped():
+    html = render_inline("[b](https://example.com/?a=1&b=2)")
+    assert html == '<a href="https://example.com/?a=1&amp;b=2">b</a>'
+
+
+def test_unsafe_link_schemes_render_as_text():
+    assert "<a" not in render_inline("[a](javascript:alert(1))")
+    assert "<a" not in render_inline("[a](JavaScript:alert(1))")
+    assert "<a" not in render_inline("[a](data:text/html,x)")
+    assert "<img" not in render_inline("![a](javascript:alert(1))")
+
+
+def test_relative_and_image_id_targets_are_kept():
+    assert render_inline("[d](/docs/page)") == '<a href="/docs/page">d</a>'
+    assert render_inline("![img-0.jpeg](img-0.jpeg)") == '<img src="img-0.jpeg" alt="img-0.jpeg">'
+
+
+def test_math_is_left_as_is():
+    assert render_inline("area $a*b*c$ here") == "area $a*b*c$ here"
+
+
+def test_nested_list():
+    html = render_markdown("- a\n  - b\n- c")
+    assert html == "<ul><li>a<ul><li>b</li></ul></li><li>c</li></ul>"
+
+
+def test_list_continuation_joins_last_item():
+    html = render_markdown("- a\n  - b\n  more\n- c")
+    assert html == "<ul><li>a<ul><li>b more</li></ul></li><li>c</li></ul>"
+
+
+def test_list_with_shallower_item_stays_well_formed():
+    for markdown in (
+        "  - a\n- b\n  more",
+        "- a\n    - b\n  - c\n- d",
+        "1. a\n   - b\n      - c\n2. d",
+    ):
+        assert_well_formed(render_markdown(markdown))
+
+
+def test_table_and_heading():
+    html = render_markdown("# Title\n\n| a | b |\n|---|---|\n| 1 | 2 |")
+    assert html == (
+        "<h1>Title</h1>\n<table><thead><tr><th>a</th><th>b</th></tr></thead>"
+        "<tbody><tr><td>1</td><td>2</td></tr></tbody></table>"
+    )
+
+
+def test_highlight_is_wrapped_and_mapped():
+    html, mapping = render_page(
+        "The mitochondria is the powerhouse of the cell.",
+        "- The mitochondria is the powerhouse of the cell.",
+    )
+    assert html == (
+        "<p><highlight index='0'>The mitochondria is the powerhouse of the cell.</highlight></p>"
+    )
+    assert mapping == {0: "The mitochondria is the powerhouse of the cell."}
+
+
+def test_highlight_across_inline_tags_is_split():
+    html, mapping = render_page(
+        "Some long sentence with a [link](https://e.com) and **bold** text inside.",
+        "- Some long sentence with a link and bold text inside.",
+    )
+    assert_well_formed(html)
+    assert html.count("<highlight index='0'>") == 5
+    assert '<a href="https://e.com"><highlight index=\'0\'>link</highlight></a>' in html
+    assert mapping == {0: "Some long sentence with a link and bold text inside."}
+
+
+def test_highlight_never_splits_math():
+    html, _ = render_page(
+        "We know that $x = y$ holds for every value here.",
+        "- We know that x = y holds for every value here.",
+    )
+    assert "$x = y$" in html
+    assert_well_formed(html)
+
+
+def test_short_and_missing_highlights_are_skipped():
+    html, mapping = inject_highlights(
+        "<p>Nothing to see in this paragraph.</p>",
+        ["to see", "A sentence that is not there at all."],
+    )
+    assert "<highlight" not in html
+    assert mapping == {}
+
+
+def test_touching_highlights_close_before_opening():
+    html, mapping = render_page(
+        "First sentence of the paragraph. Second sentence of the paragraph.",
+        "- First sentence of the paragraph.\n- Second sentence of the paragraph.",
+    )
+    assert_well_formed(html)
+    assert len(mapping) == 2
+    assert re.search(r"</highlight> ?<highlight index='1'>", html)
@@ -0,0 +1,75 @@
+import asyncio
+from typing import Any, Awaitable, Callable, List, Optional, Set
+
+
+class MicroBatcher:
+    """
+    Group calls made at about the same time into one batched call.
+    Items wait at most `window` seconds for company, and a batch is sent as
+    soon as their combined cost reaches `budget`.
+    """
+
+    def __init__(
+        self,
+        run_batch: Callable[[List[Any]], Awaitable[List[Any]]],
+        budget: int,
+        window: float,
+        cost: Callable[[Any], int],
+    ):
+        self.run_batch = run_batch
+        self.budget = budget
+        self.window = window
+        self.cost = cost
+        self._pending: List[tuple] = []
+        self._pending_cost = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def submit(self, item: Any) -> Any:
+        future = asyncio.get_running_loop().create_future()
+        cost = self.cost(item)
+
+        if self._pending and self._pending_cost + cost > self.budget:
+            self._flush()
+
+        self._pending.append((item, future))
+        self._pending_cost += cost
+
+        if self._pending_cost >= self.budget:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.window, self._flush)
+
+        return await future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        batch, self._pending, self._pending_cost = self._pending, [], 0
+        if not batch:
+            return
+
+        task = asyncio.create_task(self._run(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: List[tuple]) -> None:
+        try:
+            results = await self.run_batch([item for item, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for n, (_, future) in enumerate(batch):
+            if future.done():
+                continue
+            if n < len(results):
+                future.set_result(results[n])
+            else:
+                future.set_exception(
+                    RuntimeError(f"Batch returned {len(results)} results for {len(batch)} items")
+                )
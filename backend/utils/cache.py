@@ -0,0 +1,139 @@
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+from utils.singleflight import SingleFlight
+
+
+# Sentinel for cache misses, so None can be cached as a value
+MISSING = object()
+
+# Every two-tier cache by name, for reporting
+CACHES: Dict[str, "TwoTierCache"] = {}
+
+
+class LRUCache:
+    """
+    In-process least-recently-used cache whose entries expire after ttl seconds
+    """
+
+    def __init__(self, maxsize: int, ttl: int):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+
+    def get(self, key: Hashable) -> Any:
+        entry = self._entries.get(key)
+        if entry is None:
+            return MISSING
+
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return MISSING
+
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+# Stored entries written between two checks of a bounded collection's size
+TRIM_INTERVAL = 100
+
+
+class TwoTierCache:
+    """
+    In-process LRU in front of a MongoDB collection with expiring entries.
+    Concurrent misses for the same key share a single computation.
+    With store_maxsize set, the entries closest to expiry are evicted from
+    the collection once it grows past that many.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        collection,
+        maxsize: int,
+        ttl: int,
+        store_maxsize: Optional[int] = None,
+    ):
+        self.name = name
+        self.collection = collection
+        self.ttl = ttl
+        self.store_maxsize = store_maxsize
+        self.local = LRUCache(maxsize, ttl)
+        self.stats = {"local_hits": 0, "store_hits": 0, "misses": 0}
+        self.evictions = 0
+        self._writes = 0
+        self._flights = SingleFlight()
+        CACHES[name] = self
+
+    async def get_or_compute(
+        self, key: str, compute: Callable[[], Awaitable[Any]]
+    ) -> Any:
+        value = self.local.get(key)
+        if value is not MISSING:
+            self.stats["local_hits"] += 1
+            return value
+
+        return await self._flights.do(key, lambda: self._load(key, compute))
+
+    async def _load(self, key: str, compute: Callable[[], Awaitable[Any]]) -> Any:
+        now = datetime.now(timezone.utc)
+        record = await self.collection.find_one(
+            {"_id": key, "expires_at": {"$gt": now}}, {"value": 1}
+        )
+        if record:
+            self.stats["store_hits"] += 1
+            self.local.set(key, record["value"])
+            return record["value"]
+
+        self.stats["misses"] += 1
+        value = await compute()
+        await self.collection.replace_one(
+            {"_id": key},
+            {"value": value, "expires_at": now + timedelta(seconds=self.ttl)},
+            upsert=True,
+        )
+        self.local.set(key, value)
+
+        self._writes += 1
+        if self.store_maxsize and self._writes % TRIM_INTERVAL == 0:
+            await self._trim()
+        return value
+
+    async def _trim(self) -> None:
+        """Evict the oldest stored entries beyond store_maxsize"""
+        excess = await self.collection.estimated_document_count() - self.store_maxsize
+        if excess <= 0:
+            return
+
+        oldest = self.collection.find({}, {"_id": 1}).sort("expires_at", 1).limit(excess)
+        ids = [record["_id"] async for record in oldest]
+        result = await self.collection.delete_many({"_id": {"$in": ids}})
+        self.evictions += result.deleted_count
+
+    def report(self) -> dict:
+        """Hit/miss counters and hit rate of the cache"""
+        lookups = sum(self.stats.values())
+        hits = self.stats["local_hits"] + self.stats["store_hits"]
+        return {
+            **self.stats,
+            "evictions": self.evictions,
+            "local_size": len(self.local),
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+def cache_stats() -> dict:
+    """Report of every registered cache"""
+    return {name: cache.report() for name, cache in CACHES.items()}
@@ -0,0 +1,105 @@
+import re
+from typing import List
+
+
+HEADING_PATTERN = re.compile(r"^#{1,6}\s")
+
+
+def count_tokens(text: str) -> int:
+    """Rough token count, about four characters per token"""
+    return len(text) // 4 + 1
+
+
+def split_blocks(markdown: str) -> List[str]:
+    """
+    Split Markdown into blocks at blank lines and before headings, keeping
+    code fences, display math and tables whole
+    """
+    blocks, current = [], []
+    fence = None
+
+    def close():
+        if current:
+            blocks.append("\n".join(current))
+            current.clear()
+
+    for line in markdown.split("\n"):
+        stripped = line.strip()
+
+        if fence:
+            current.append(line)
+            if stripped.startswith(fence) or (fence == "$$" and stripped.endswith("$$")):
+                fence = None
+            continue
+
+        if stripped.startswith("```") or (
+            stripped.startswith("$$") and (stripped == "$$" or not stripped.endswith("$$"))
+        ):
+            fence = stripped[:3] if stripped.startswith("```") else "$$"
+        elif not stripped:
+            close()
+            continue
+        elif HEADING_PATTERN.match(stripped):
+            close()
+        elif current and stripped.startswith("|") != current[-1].strip().startswith("|"):
+            # Tables start and end their own block
+            close()
+
+        current.append(line)
+
+    close()
+    return blocks
+
+
+def split_table(table: str, max_tokens: int) -> List[str]:
+    """Split a Markdown table by rows, repeating the header in every part"""
+    lines = table.split("\n")
+    header, rows = lines[:2], lines[2:]
+    parts, current = [], []
+    budget = max_tokens - count_tokens("\n".join(header))
+
+    for row in rows:
+        if current and count_tokens("\n".join(current + [row])) > budget:
+            parts.append("\n".join(header + current))
+            current = []
+        current.append(row)
+
+    if current or not parts:
+        parts.append("\n".join(header + current))
+    return parts
+
+
+def split_markdown(markdown: str, max_tokens: int) -> List[str]:
+    """
+    Split page Markdown into chunks of at most about max_tokens, cutting
+    only between blocks and preferring to start a chunk at a heading.
+    Oversized tables are split by rows; other oversized blocks stay whole.
+
+    Returns: the chunks in page order
+    """
+    if count_tokens(markdown) <= max_tokens:
+        return [markdown]
+
+    blocks = []
+    for block in split_blocks(markdown):
+        if block.lstrip().startswith("|") and count_tokens(block) > max_tokens:
+            blocks.extend(split_table(block, max_tokens))
+        else:
+            blocks.append(block)
+
+    chunks, current, size = [], [], 0
+    for block in blocks:
+        tokens = count_tokens(block)
+        # Close a half-full chunk early rather than separate a heading from
+        # the section it introduces
+        at_heading = HEADING_PATTERN.match(block.lstrip()) and size > max_tokens // 2
+        heading_only = len(current) == 1 and HEADING_PATTERN.match(current[0].lstrip())
+        if current and not heading_only and (size + tokens > max_tokens or at_heading):
+            chunks.append("\n\n".join(current))
+            current, size = [], 0
+        current.append(block)
+        size += tokens
+
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
@@ -1,9 +1,13 @@
 import os
-from typing import Dict, Optional
+from typing import Dict, Optional, Union
 
 import cloudinary
 import cloudinary.uploader
 
+from utils.executor import run_blocking
+from utils.providers import call_provider, get_provider
+
+
 def init_cloudinary():
     """Initialize Cloudinary configuration"""
     cloudinary.config(
@@ -14,26 +18,45 @@ def init_cloudinary():
     )
 
 
-def upload_to_cloudinary(
-    file: str, public_id: str, type: str = "image"
+def _upload(
+    file: Union[str, bytes], public_id: str, type: str = "image", timeout: Optional[float] = None
 ) -> Optional[Dict]:
     """
     Upload a file to Cloudinary and generate thumbnails
+    Images may be raw bytes or base64 strings
     Returns: Dictionary containing image URLs and metadata
     """
-    try:
-        if type == "image":
-            if "data:image" not in file:
-                file = f"data:image/png;base64,{file}"
+    if type == "image" and isinstance(file, str):
+        if "data:image" not in file:
+            file = f"data:image/png;base64,{file}"
 
-        upload_result = cloudinary.uploader.upload(
-            file=file, public_id=public_id, folder="smartread", overwrite=False
-        )
+    upload_result = cloudinary.uploader.upload(
+        file=file, public_id=public_id, folder="smartread", overwrite=False, timeout=timeout
+    )
+
+    # Get URLs for different versions
+    original_url = upload_result["secure_url"]
 
-        # Get URLs for different versions
-        original_url = upload_result["secure_url"]
+    return original_url
 
-        return original_url
+
+async def upload_to_cloudinary(
+    file: Union[str, bytes], public_id: str, type: str = "image"
+) -> Optional[Dict]:
+    """
+    Upload a file to Cloudinary without blocking the event loop.
+    The Cloudinary SDK is synchronous, so the upload runs on the shared
+    blocking executor, with the provider timeout applied to the request.
+    Transient failures are retried; uploads are idempotent since existing
+    public ids are never overwritten.
+    """
+    timeout = get_provider("cloudinary").timeout
+    try:
+        return await call_provider(
+            "cloudinary",
+            lambda: run_blocking(_upload, file, public_id, type, timeout),
+            blocking=True,
+        )
     except Exception as e:
         print(f"Error uploading image: {str(e)}")
         return None
@@ -1,19 +1,28 @@
 import os
+import json
+import zlib
 import base64
+import hashlib
+from datetime import datetime, timedelta, timezone
+from typing import Optional
 
-from pymongo import MongoClient
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError, OperationFailure
+
+from utils.events import page_events
 
 
 # Initialize database connection at module level
 def _init_database():
     """
-    Initialize MongoDB database connection
+    Initialize MongoDB database connection using the async Motor driver
     """
     mongodb_url = os.getenv("MONGODB_URL")
     if not mongodb_url:
         raise ValueError("MongoDB URL not configured")
 
-    client = MongoClient(mongodb_url)
+    client = AsyncIOMotorClient(mongodb_url)
     return client.smartread
 
 
@@ -21,78 +30,717 @@ def _init_database():
 db = _init_database()
 
 
-def store_page(url: str, page_number: int, page_data: dict, total_pages: int):
+# Unique (document_id, page_number) key shared by the per-page collections
+PAGE_KEY = [("document_id", ASCENDING), ("page_number", ASCENDING)]
+
+# Seconds an annotated PDF stays registered; its key covers the source file
+# and highlights, so entries only go stale, they never need invalidating
+ANNOTATED_PDF_TTL = int(os.getenv("ANNOTATED_PDF_TTL", str(30 * 24 * 3600)))
+
+
+async def _remove_duplicate_pages(collection):
     """
-    Store page data in MongoDB with HTML content encoded in base64
+    Keep one record per (document_id, page_number), written before upserts
+    made pages unique, so the unique index can be built
     """
-    collection = db.pages
+    duplicates = collection.aggregate(
+        [
+            {
+                "$group": {
+                    "_id": {"document_id": "$document_id", "page_number": "$page_number"},
+                    "ids": {"$push": "$_id"},
+                    "count": {"$sum": 1},
+                }
+            },
+            {"$match": {"count": {"$gt": 1}}},
+        ],
+        allowDiskUse=True,
+    )
+    async for duplicate in duplicates:
+        await collection.delete_many({"_id": {"$in": duplicate["ids"][1:]}})
+
+
+async def ensure_indexes():
+    """
+    Create the indexes the queries below rely on
+    The unique indexes also make lease acquisition and page upserts atomic
+    """
+    await db.documents.create_index("document_id", unique=True)
+
+    # Expired cache entries are removed by MongoDB's TTL monitor
+    await db.search_cache.create_index("expires_at", expireAfterSeconds=0)
+    await db.llm_cache.create_index("expires_at", expireAfterSeconds=0)
+    try:
+        await db.annotated_pdfs.create_index("created_at", expireAfterSeconds=ANNOTATED_PDF_TTL)
+    except OperationFailure:
+        # The index exists with another TTL
+        await db.command(
+            "collMod",
+            "annotated_pdfs",
+            index={"keyPattern": {"created_at": 1}, "expireAfterSeconds": ANNOTATED_PDF_TTL},
+        )
+
+    for collection in (db.pages, db.ocr_pages):
+        try:
+            await collection.create_index(PAGE_KEY, unique=True)
+        except OperationFailure:
+            await _remove_duplicate_pages(collection)
+            await collection.create_index(PAGE_KEY, unique=True)
 
-    document_id = f"{base64.b64encode(url.encode()).decode()}"
 
-    page_data["content"] = base64.b64encode(page_data["content"].encode()).decode()
+# Page storage format: 1 = base64 HTML content and plain resources,
+# 2 = zlib-compressed binary content and JSON resources
+STORAGE_VERSION = 2
+
+
+def _page_etag(page_data: dict) -> str:
+    """
+    Fingerprint the decoded content of a page for client-side caching
+    """
+    payload = json.dumps(page_data, sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+
+def highlights_hash(highlights: list) -> str:
+    """
+    Fingerprint the highlight sentences of a page, so geometry computed for
+    them can be told apart from geometry of an older version
+    """
+    return hashlib.sha1(json.dumps(highlights).encode()).hexdigest()
+
+
+def _encode_page_data(page_data: dict) -> dict:
+    """
+    Compress the HTML content and resources of a page for storage
+    """
+    page_data["content"] = zlib.compress(page_data["content"].encode())
 
+    if "resources" in page_data:
+        resources = {str(k): v for k, v in page_data["resources"].items()}
+        page_data["resources"] = zlib.compress(json.dumps(resources).encode())
+
+    return page_data
+
+
+def _decode_page_data(page_data: dict, storage_version: int) -> dict:
+    """
+    Restore the HTML content and resources of a stored page
+    """
+    if storage_version >= 2:
+        page_data["content"] = zlib.decompress(page_data["content"]).decode()
+        if isinstance(page_data.get("resources"), bytes):
+            page_data["resources"] = json.loads(
+                zlib.decompress(page_data["resources"])
+            )
+    elif "content" in page_data:
+        page_data["content"] = base64.b64decode(page_data["content"]).decode()
+
+    return page_data
+
+
+async def _load_page(record: dict) -> dict:
+    """
+    Decode a stored page record, rewriting legacy base64 records in the
+    current format, and storing a missing etag, the first time they are read
+    """
+    storage_version = record.get("storage_version", 1)
+    if "page_data" not in record:
+        return record
+
+    record["page_data"] = _decode_page_data(record["page_data"], storage_version)
+    # Fingerprint the page before on-demand resources are merged in, since
+    # writing those keeps the etag
+    missing_etag = "etag" not in record
+    if missing_etag:
+        record["etag"] = _page_etag(record["page_data"])
+
+    # Resources computed on demand are kept per highlight next to the page
+    if "highlight_resources" in record:
+        resources = dict(record["page_data"].get("resources", {}))
+        for index, value in record.pop("highlight_resources").items():
+            resources[index] = json.loads(zlib.decompress(value)) if isinstance(value, bytes) else value
+        record["page_data"]["resources"] = resources
+    # Highlight geometry is only read when annotating the PDF
+    record.pop("highlight_rects", None)
+
+    if storage_version < STORAGE_VERSION:
+        await db.pages.update_one(
+            {
+                "document_id": record["document_id"],
+                "page_number": record["page_number"],
+                "storage_version": {"$exists": False},
+            },
+            {
+                "$set": {
+                    "page_data": _encode_page_data(dict(record["page_data"])),
+                    "storage_version": STORAGE_VERSION,
+                    "etag": record["etag"],
+                }
+            },
+        )
+    elif missing_etag:
+        # Stored etags let range queries skip the page when it is unchanged
+        await db.pages.update_one(
+            {
+                "document_id": record["document_id"],
+                "page_number": record["page_number"],
+                "etag": {"$exists": False},
+            },
+            {"$set": {"etag": record["etag"]}},
+        )
+
+    return record
+
+
+def get_document_id(url: str) -> str:
+    """
+    Build the document identifier used across collections for a URL
+    """
+    return f"{base64.b64encode(url.encode()).decode()}"
+
+
+async def store_page(url: str, page_number: int, page_data: dict, total_pages: int):
+    """
+    Store page data in MongoDB with HTML content and resources zlib-compressed
+    """
+    collection = db.pages
+
+    document_id = get_document_id(url)
+
+    # Work on a copy so the caller's page stays readable after storing
+    page_data = dict(page_data)
     if "resources" in page_data:
         page_data["resources"] = {str(k): v for k, v in page_data["resources"].items()}
 
-    # Insert the document
-    collection.insert_one(
+    # Fingerprint the page as readers will receive it, before compression
+    etag = _page_etag(page_data)
+    page_data = _encode_page_data(page_data)
+
+    # Upsert so a page written twice never produces duplicate documents
+    await collection.replace_one(
+        {"document_id": document_id, "page_number": page_number},
         {
             "document_id": document_id,
             "url": url,
             "page_number": page_number,
             "page_data": page_data,
             "total_pages": total_pages,
-        }
+            "storage_version": STORAGE_VERSION,
+            "etag": etag,
+        },
+        upsert=True,
     )
+    # Pages with images still to host are not final until the upload fills
+    # their URLs in, see set_page_images_ready
+    images_ready = all(image.get("image_url") for image in page_data.get("images", []))
+    await set_page_status(url, page_number, "ready", images_ready=images_ready)
+    page_events.publish(document_id)
     return document_id
 
 
-def check_page_exists(url: str, page_number: int) -> bool:
+async def check_page_exists(url: str, page_number: int) -> bool:
     """
     Check if a specific page exists for a URL
     Returns: bool indicating if the page exists
     """
     collection = db.pages
 
-    document_id = f"{base64.b64encode(url.encode()).decode()}"
-    return (
-        collection.count_documents(
-            {"document_id": document_id, "page_number": page_number}
-        )
-        > 0
+    document_id = get_document_id(url)
+    # Projecting only indexed fields lets the unique index cover the query
+    page = await collection.find_one(
+        {"document_id": document_id, "page_number": page_number},
+        {"_id": 0, "page_number": 1},
     )
+    return page is not None
 
 
-def get_page(url: str, page_number: int):
+async def get_page(url: str, page_number: int):
     """
     Retrieve page data from MongoDB and total page count
-    Returns: (page_data, total_pages) with decoded HTML content
+    Returns: (page_data, total_pages) with decoded HTML content and resources
     """
     collection = db.pages
 
-    document_id = f"{base64.b64encode(url.encode()).decode()}"
-    page_data = collection.find_one(
-        {"document_id": document_id, "page_number": page_number}
+    document_id = get_document_id(url)
+    page_data = await collection.find_one(
+        {"document_id": document_id, "page_number": page_number},
+        {"_id": 0},
+    )
+
+    if not page_data:
+        return None, None
+
+    page_data = await _load_page(page_data)
+    return page_data, page_data.get("total_pages")
+
+
+async def get_pages(
+    url: str, known_etags=None, start_page: Optional[int] = None, end_page: Optional[int] = None
+):
+    """
+    Retrieve the stored pages of a document, optionally within a page range,
+    in one query, leaving out pages whose etag matches the one the caller
+    already has
+    Returns: List of page documents with decoded HTML content and resources,
+    ordered by page
+    """
+    query = {"document_id": get_document_id(url)}
+    if start_page is not None:
+        query["page_number"] = {"$gte": start_page, "$lte": end_page}
+    if known_etags:
+        query["$nor"] = [
+            {"page_number": page_number, "etag": etag}
+            for page_number, etag in known_etags.items()
+        ]
+
+    cursor = db.pages.find(query, {"_id": 0, "url": 0}).sort("page_number", 1)
+    return [await _load_page(page_data) async for page_data in cursor]
+
+
+def annotated_pdf_key(source_hash: str, geometry: dict) -> str:
+    """
+    Cache key of an annotated PDF: the source file's content hash plus the
+    highlights of every page, as returned by get_highlight_geometry
+    """
+    pages = sorted(
+        (page_num, highlights_hash(page["highlights"]))
+        for page_num, page in geometry.items()
     )
+    payload = json.dumps([source_hash, pages])
+    return hashlib.sha256(payload.encode()).hexdigest()
 
-    if page_data and "page_data" in page_data and "content" in page_data["page_data"]:
-        page_data["page_data"]["content"] = base64.b64decode(
-            page_data["page_data"]["content"]
-        ).decode()
 
-    return page_data, 15
+async def get_annotated_pdf(key: str):
+    """
+    Look up a previously annotated and hosted PDF
+    Returns: Hosted PDF URL or None
+    """
+    record = await db.annotated_pdfs.find_one({"_id": key}, {"pdf_url": 1})
+    return record["pdf_url"] if record else None
 
 
-def get_highlights(url: str):
+async def store_annotated_pdf(key: str, url: str, pdf_url: str):
+    """Register the hosted URL of an annotated PDF under its cache key"""
+    await db.annotated_pdfs.replace_one(
+        {"_id": key},
+        {
+            "document_id": get_document_id(url),
+            "pdf_url": pdf_url,
+            "created_at": datetime.now(timezone.utc),
+        },
+        upsert=True,
+    )
+
+
+async def get_source_hash(url: str):
     """
-    Retrieve highlights from MongoDB
-    Returns: List of highlights
+    Returns: Content hash of the document's PDF when it was last fetched,
+    or None
     """
-    document_id = f"{base64.b64encode(url.encode()).decode()}"
-    pages = db.pages.find({"document_id": document_id})
+    record = await db.documents.find_one(
+        {"document_id": get_document_id(url)}, {"source_hash": 1}
+    )
+    return record.get("source_hash") if record else None
+
+
+async def set_source_hash(url: str, source_hash: str):
+    """Record the content hash of the document's PDF"""
+    await db.documents.update_one(
+        {"document_id": get_document_id(url)},
+        {"$set": {"source_hash": source_hash}},
+    )
 
-    highlights_dict = {}
-    for page in pages:
-        highlights_dict[page["page_number"] - 1] = page["page_data"]["highlights"]
 
-    return highlights_dict
+async def get_highlight_geometry(url: str, source_hash: Optional[str] = None):
+    """
+    Retrieve the highlights of every stored page with their rectangles in
+    the PDF, when those were computed for the current highlights and source
+    file. source_hash defaults to the hash of the last fetched file.
+    Returns: Dictionary of {"highlights", "rects"} by zero-based page number,
+    with rects None where geometry is missing or stale
+    """
+    if source_hash is None:
+        source_hash = await get_source_hash(url)
+
+    document_id = get_document_id(url)
+    pages = db.pages.find(
+        {"document_id": document_id},
+        {"_id": 0, "page_number": 1, "page_data.highlights": 1, "highlight_rects": 1},
+    )
+
+    geometry = {}
+    async for page in pages:
+        highlights = page["page_data"]["highlights"]
+        stored = page.get("highlight_rects")
+        fresh = (
+            stored
+            and stored["highlights_hash"] == highlights_hash(highlights)
+            and source_hash is not None
+            and stored.get("source_hash") == source_hash
+        )
+        geometry[page["page_number"] - 1] = {
+            "highlights": highlights,
+            "rects": stored["rects"] if fresh else None,
+        }
+
+    return geometry
+
+
+async def set_highlight_rects(
+    url: str, page_number: int, highlights: list, rects: list, source_hash: str
+):
+    """
+    Store the PDF rectangles of a page's highlights, one list per sentence,
+    with the hash of the file they were located in. The page etag is left
+    alone since readers never see them.
+    """
+    document_id = get_document_id(url)
+    await db.pages.update_one(
+        {"document_id": document_id, "page_number": page_number},
+        {
+            "$set": {
+                "highlight_rects": {
+                    "highlights_hash": highlights_hash(highlights),
+                    "source_hash": source_hash,
+                    "rects": rects,
+                }
+            }
+        },
+    )
+
+
+async def store_ocr_response(url: str, ocr_pages: list):
+    """
+    Persist the OCR output of a document, one record per page
+    Each entry holds the page markdown, dimensions and images as returned by OCR
+    """
+    document_id = get_document_id(url)
+
+    for ocr_page in ocr_pages:
+        await db.ocr_pages.replace_one(
+            {"document_id": document_id, "page_number": ocr_page["index"] + 1},
+            {
+                "document_id": document_id,
+                "page_number": ocr_page["index"] + 1,
+                "ocr_page": ocr_page,
+            },
+            upsert=True,
+        )
+
+
+async def get_ocr_pages(url: str, start_page: int = 1):
+    """
+    Retrieve the stored OCR output for a document from start_page onwards
+    Returns: List of OCR page dicts ordered by page number
+    """
+    cursor = db.ocr_pages.find(
+        {"document_id": get_document_id(url), "page_number": {"$gte": start_page}},
+        {"_id": 0, "ocr_page": 1},
+    ).sort("page_number", 1)
+    return [record["ocr_page"] async for record in cursor]
+
+
+async def set_document_status(url: str, status: str, **fields):
+    """
+    Create or update the job-state record of a document
+    Status is one of: ocr, processing, completed, failed
+    """
+    now = datetime.now(timezone.utc)
+    await db.documents.update_one(
+        {"document_id": get_document_id(url)},
+        {
+            "$set": {"url": url, "status": status, "updated_at": now, **fields},
+            "$setOnInsert": {"created_at": now},
+        },
+        upsert=True,
+    )
+
+
+async def get_document(url: str):
+    """
+    Retrieve the job-state record of a document
+    Returns: Document dict or None if the URL was never submitted
+    """
+    return await db.documents.find_one(
+        {"document_id": get_document_id(url)}, {"page_requests": 0}
+    )
+
+
+async def set_page_status(url: str, page_number: int, status: str, **fields):
+    """
+    Record the status of one page in the document manifest
+    Status is one of: ready, failed
+    """
+    now = datetime.now(timezone.utc)
+    await db.documents.update_one(
+        {"document_id": get_document_id(url)},
+        {
+            "$set": {
+                f"page_status.{page_number}": {
+                    "status": status,
+                    "updated_at": now,
+                    **fields,
+                },
+                "updated_at": now,
+            },
+            "$setOnInsert": {"url": url, "created_at": now},
+        },
+        upsert=True,
+    )
+
+
+async def acquire_lease(url: str, owner: str, ttl_seconds: int) -> bool:
+    """
+    Try to take the processing lease of a document
+    Succeeds only when no other worker holds an unexpired lease
+    Returns: bool indicating if the lease was acquired
+    """
+    now = datetime.now(timezone.utc)
+    try:
+        await db.documents.update_one(
+            {
+                "document_id": get_document_id(url),
+                "$or": [
+                    {"lease_expires_at": None},
+                    {"lease_expires_at": {"$lt": now}},
+                ],
+            },
+            {
+                "$set": {
+                    "url": url,
+                    "lease_owner": owner,
+                    "lease_expires_at": now + timedelta(seconds=ttl_seconds),
+                },
+                "$setOnInsert": {"created_at": now, "status": "ocr"},
+            },
+            upsert=True,
+        )
+        return True
+    except DuplicateKeyError:
+        # The document exists and its lease is held by someone else
+        return False
+
+
+async def renew_lease(url: str, owner: str, ttl_seconds: int) -> bool:
+    """
+    Extend a lease held by owner
+    Returns: bool indicating if the lease is still held
+    """
+    result = await db.documents.update_one(
+        {"document_id": get_document_id(url), "lease_owner": owner},
+        {
+            "$set": {
+                "lease_expires_at": datetime.now(timezone.utc)
+                + timedelta(seconds=ttl_seconds)
+            }
+        },
+    )
+    return result.matched_count > 0
+
+
+async def release_lease(url: str, owner: str):
+    """
+    Release a lease held by owner
+    """
+    await db.documents.update_one(
+        {"document_id": get_document_id(url), "lease_owner": owner},
+        {"$unset": {"lease_owner": "", "lease_expires_at": ""}},
+    )
+
+
+async def request_page(url: str, page_number: int):
+    """
+    Record that a reader is waiting for a page so whichever worker
+    processes the document can move it ahead of the backlog
+    """
+    await db.documents.update_one(
+        {"document_id": get_document_id(url)},
+        {
+            "$push": {
+                "page_requests": {
+                    "$each": [
+                        {
+                            "page_number": page_number,
+                            "requested_at": datetime.now(timezone.utc),
+                        }
+                    ],
+                    "$slice": -20,
+                }
+            }
+        },
+    )
+
+
+async def get_page_requests(url: str):
+    """
+    Retrieve the most recent page requests of a document, oldest first
+    Returns: List of {page_number, requested_at} dicts
+    """
+    document = await db.documents.find_one(
+        {"document_id": get_document_id(url)}, {"page_requests": 1}
+    )
+    return (document or {}).get("page_requests", [])
+
+
+async def get_stored_total_pages(url: str):
+    """
+    Total page count recorded on the stored pages of a document, for
+    documents stored before the manifest existed
+    Returns: Page count or None when no page is stored
+    """
+    page = await db.pages.find_one(
+        {"document_id": get_document_id(url)}, {"total_pages": 1}
+    )
+    return page.get("total_pages") if page else None
+
+
+async def get_stored_page_numbers(url: str):
+    """
+    Retrieve the page numbers already stored for a document
+    Returns: List of page numbers
+    """
+    return await db.pages.distinct(
+        "page_number", {"document_id": get_document_id(url)}
+    )
+
+
+async def get_thumbnail_urls(video_ids: list) -> dict:
+    """
+    Look up hosted thumbnails of videos in the thumbnail registry
+    Returns: Dictionary mapping known video ids to their thumbnail URL
+    """
+    cursor = db.thumbnails.find({"_id": {"$in": video_ids}}, {"image_url": 1})
+    return {record["_id"]: record["image_url"] async for record in cursor}
+
+
+async def store_thumbnail_url(video_id: str, image_url: str):
+    """
+    Register the hosted thumbnail of a video
+    """
+    await db.thumbnails.update_one(
+        {"_id": video_id},
+        {
+            "$set": {"image_url": image_url},
+            "$setOnInsert": {"created_at": datetime.now(timezone.utc)},
+        },
+        upsert=True,
+    )
+
+
+async def get_image_urls(content_hashes: list) -> dict:
+    """
+    Look up hosted images by the sha256 of their bytes
+    Returns: Dictionary mapping known content hashes to their image URL
+    """
+    cursor = db.images.find({"_id": {"$in": content_hashes}}, {"image_url": 1})
+    return {record["_id"]: record["image_url"] async for record in cursor}
+
+
+async def store_image_url(content_hash: str, image_url: str):
+    """
+    Register the hosted URL of an image by the sha256 of its bytes
+    """
+    await db.images.update_one(
+        {"_id": content_hash},
+        {
+            "$set": {"image_url": image_url},
+            "$setOnInsert": {"created_at": datetime.now(timezone.utc)},
+        },
+        upsert=True,
+    )
+
+
+async def set_page_image_urls(url: str, page_number: int, image_urls: dict):
+    """
+    Fill in the hosted URLs of a stored page's images in place
+    The etag is recomputed from the updated page, so writing the same URLs
+    again leaves it unchanged and clients keep their copy
+    """
+    if not image_urls:
+        return
+
+    document_id = get_document_id(url)
+    page_key = {"document_id": document_id, "page_number": page_number}
+    filters = {f"i{n}": image_id for n, image_id in enumerate(image_urls)}
+    record = await db.pages.find_one_and_update(
+        page_key,
+        {
+            "$set": {
+                f"page_data.images.$[{name}].image_url": image_urls[image_id]
+                for name, image_id in filters.items()
+            }
+        },
+        array_filters=[{f"{name}.id": image_id} for name, image_id in filters.items()],
+        projection={"page_data": 1, "storage_version": 1, "etag": 1},
+        return_document=ReturnDocument.AFTER,
+    )
+    if record is None:
+        return
+
+    page_data = _decode_page_data(record["page_data"], record.get("storage_version", 1))
+    etag = _page_etag(page_data)
+    if etag == record.get("etag"):
+        return
+
+    await db.pages.update_one(page_key, {"$set": {"etag": etag}})
+    page_events.publish(document_id)
+
+
+async def set_page_images_ready(url: str, page_number: int):
+    """Mark every image of a stored page as hosted in the document manifest"""
+    document_id = get_document_id(url)
+    await db.documents.update_one(
+        {"document_id": document_id},
+        {"$set": {f"page_status.{page_number}.images_ready": True}},
+    )
+    page_events.publish(document_id)
+
+
+async def get_pages_missing_images(url: str):
+    """
+    Page numbers of stored pages with at least one image not hosted yet
+    Returns: List of page numbers
+    """
+    pages = db.pages.find(
+        {
+            "document_id": get_document_id(url),
+            "page_data.images": {"$elemMatch": {"image_url": None}},
+        },
+        {"_id": 0, "page_number": 1},
+    )
+    return [page["page_number"] async for page in pages]
+
+
+def pages_finalized(document: dict) -> bool:
+    """
+    Whether every page in a document manifest is stored with its images
+    hosted. Pages recorded before images were tracked count as hosted.
+    """
+    total_pages = document.get("total_pages")
+    page_status = document.get("page_status", {})
+    if not total_pages or len(page_status) < total_pages:
+        return False
+    return all(
+        status["status"] == "ready" and status.get("images_ready", True)
+        for status in page_status.values()
+    )
+
+
+async def set_highlight_resources(
+    url: str, page_number: int, highlight_index: int, resources: dict
+):
+    """
+    Store the related resources of one highlight of a stored page,
+    compressed like the page itself. The page keeps its etag: clients fetch
+    resources per highlight, so re-sending the page would only cost bandwidth
+    """
+    await db.pages.update_one(
+        {"document_id": get_document_id(url), "page_number": page_number},
+        {
+            "$set": {
+                f"highlight_resources.{highlight_index}": zlib.compress(
+                    json.dumps(resources).encode()
+                ),
+            }
+        },
+    )
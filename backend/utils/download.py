@@ -1,9 +1,13 @@
+import io
 import os
 import requests
 import fitz
 import logging
+from typing import Optional
 from urllib.parse import urlparse
 
+from utils.geometry import locate_highlights_parallel
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
@@ -11,66 +15,108 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-def download_and_highlight_pdf(url: str, highlights: dict) -> bool:
+def fetch_pdf(url: str) -> bytes:
+    """
+    Download a PDF into memory
+    Returns: The PDF bytes
+    """
+    response = requests.get(url, stream=True, timeout=10)
+    response.raise_for_status()
+
+    buffer = io.BytesIO()
+    for chunk in response.iter_content(chunk_size=64 * 1024):
+        if chunk:
+            buffer.write(chunk)
+    return buffer.getvalue()
+
+
+def apply_highlights(doc: fitz.Document, geometry: dict) -> int:
+    """
+    Add a highlight annotation over every highlight rectangle. Pages whose
+    rectangles were not precomputed are located in the text layer now,
+    spread over the PDF worker processes, and drawn here so the document is
+    still saved once.
+
+    :param geometry: {"highlights", "rects"} by zero-based page number
+    :return: Number of highlight rectangles drawn
+    """
+    missing = {
+        page_num: page_geometry["highlights"]
+        for page_num, page_geometry in geometry.items()
+        if page_geometry["rects"] is None
+    }
+    located = locate_highlights_parallel(doc.name, missing) if missing else {}
+
+    total = 0
+    for page_num, page_geometry in geometry.items():
+        page = doc[page_num]
+        rects = page_geometry["rects"]
+        if rects is None:
+            rects = located.get(page_num, [])
+
+        page_rects = [fitz.Rect(rect) for sentence_rects in rects for rect in sentence_rects]
+        for rect in page_rects:
+            highlight = page.add_highlight_annot(rect)
+            highlight.update()
+
+        logger.info(f"Highlighted {len(page_rects)} areas on page {page_num + 1}")
+        total += len(page_rects)
+    return total
+
+
+def download_and_highlight_pdf(
+    url: str, geometry: dict, output_dir: str, pdf_bytes: Optional[bytes] = None
+):
     """
-    Download a PDF from URL, highlight specified text, and save both original and highlighted versions.
+    Download a PDF from URL, highlight specified text, and write the highlighted
+    version to output_dir. All annotations are applied before a single,
+    incremental save, so only the annotations are appended to the file.
 
     :param url: The URL of the PDF file to be downloaded
-    :param highlights: Dictionary of highlights for each page
-    :return: True if successful, False otherwise
+    :param geometry: Highlights and their rectangles for each page
+    :param output_dir: Directory for the highlighted file, unique per request
+    :param pdf_bytes: The PDF, when the caller already downloaded it
+    :return: (True, original filename, highlighted file path) if successful,
+        (False, None, None) otherwise
     """
     try:
-        response = requests.get(url, stream=True, timeout=10)
-
-        if response.status_code == 200:
-            parsed_url = urlparse(url)
-            original_filename = os.path.basename(parsed_url.path)
-            if not original_filename.lower().endswith(".pdf"):
-                original_filename += ".pdf"
-
-            highlighted_filename = f"highlighted_{original_filename}"
-
-            filepath = os.path.join(os.getcwd(), original_filename)
-            with open(filepath, "wb") as pdf_file:
-                for chunk in response.iter_content(chunk_size=1024):
-                    if chunk:
-                        pdf_file.write(chunk)
-
-            # Highlight the PDF
-            doc = fitz.open(filepath)
-
-            for page_num, sentences_to_highlight in highlights.items():
-                if page_num < 0 or page_num >= len(doc):
-                    logger.error(f"Invalid page number. PDF has {len(doc)} pages.")
-                    return False
-
-                page = doc[page_num]
-                text_instances = []
-                for sentence in sentences_to_highlight:
-                    text_instances.extend(page.search_for(sentence))
-
-                for inst in text_instances:
-                    highlight = page.add_highlight_annot(inst)
-                    highlight.update()
-
-                highlighted_filepath = os.path.join(os.getcwd(), highlighted_filename)
-                doc.save(highlighted_filepath, garbage=4, deflate=True)
-                logger.info(
-                    f"Found and highlighted {len(text_instances)} matches on page {page_num + 1}"
-                )
-
-            doc.close()
-            return True, original_filename, highlighted_filepath
-
-        else:
-            logger.error(
-                f"Failed to download file. Status code: {response.status_code}"
-            )
-            return False
+        if pdf_bytes is None:
+            pdf_bytes = fetch_pdf(url)
+
+        parsed_url = urlparse(url)
+        original_filename = os.path.basename(parsed_url.path) or "document"
+        if not original_filename.lower().endswith(".pdf"):
+            original_filename += ".pdf"
+
+        highlighted_filepath = os.path.join(output_dir, f"highlighted_{original_filename}")
+        with open(highlighted_filepath, "wb") as pdf_file:
+            pdf_file.write(pdf_bytes)
+
+        doc = fitz.open(highlighted_filepath)
+        try:
+            invalid = [page_num for page_num in geometry if not 0 <= page_num < len(doc)]
+            if invalid:
+                logger.error(f"Invalid page number. PDF has {len(doc)} pages.")
+                return False, None, None
+
+            apply_highlights(doc, geometry)
+
+            if doc.can_save_incrementally():
+                doc.saveIncr()
+            else:
+                # Repaired or encrypted files can't be appended to
+                doc.save(f"{highlighted_filepath}.tmp", garbage=1, deflate=True)
+                doc.close()
+                os.replace(f"{highlighted_filepath}.tmp", highlighted_filepath)
+        finally:
+            if not doc.is_closed:
+                doc.close()
+
+        return True, original_filename, highlighted_filepath
 
     except requests.RequestException as e:
         logger.error(f"Download error: {e}")
-        return False
+        return False, None, None
     except Exception as e:
         logger.error(f"Processing error: {e}")
-        return False
+        return False, None, None
@@ -0,0 +1,35 @@
+import asyncio
+from typing import Dict, Set
+
+
+class PageEvents:
+    """
+    In-process notification of stored pages, keyed by document id.
+    Subscribers get an asyncio.Event that is set whenever a page of their
+    document is stored by this process. Pages stored by other processes are
+    picked up by the subscriber's own periodic check instead.
+    """
+
+    def __init__(self):
+        self._subscribers: Dict[str, Set[asyncio.Event]] = {}
+
+    def subscribe(self, document_id: str) -> asyncio.Event:
+        event = asyncio.Event()
+        self._subscribers.setdefault(document_id, set()).add(event)
+        return event
+
+    def unsubscribe(self, document_id: str, event: asyncio.Event) -> None:
+        subscribers = self._subscribers.get(document_id)
+        if subscribers is None:
+            return
+        subscribers.discard(event)
+        if not subscribers:
+            del self._subscribers[document_id]
+
+    def publish(self, document_id: str) -> None:
+        for event in self._subscribers.get(document_id, ()):
+            event.set()
+
+
+# Global notifier shared by store_page and the streaming endpoint
+page_events = PageEvents()
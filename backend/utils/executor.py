@@ -0,0 +1,60 @@
+import os
+import asyncio
+import functools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+
+# Threads shared by every blocking call (Cloudinary SDK, PDF work) in the
+# process, so concurrent pages can never spawn an unbounded number of threads
+BLOCKING_WORKERS = int(os.getenv("BLOCKING_WORKERS", "8"))
+
+_executor = ThreadPoolExecutor(
+    max_workers=BLOCKING_WORKERS, thread_name_prefix="smartread-blocking"
+)
+
+
+async def run_blocking(fn, *args, **kwargs):
+    """Run a blocking function on the shared executor without blocking the event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(fn, *args, **kwargs))
+
+
+# Processes for CPU-bound PDF work that would otherwise hold one core per
+# request. 0 or 1 keeps that work on the blocking threads.
+PDF_ANNOTATION_WORKERS = int(
+    os.getenv("PDF_ANNOTATION_WORKERS", str(min(4, os.cpu_count() or 1)))
+)
+
+_process_pool = None
+
+
+def get_process_pool():
+    """
+    Return the shared process pool, started on first use
+    Returns: ProcessPoolExecutor, or None when process workers are disabled
+    """
+    global _process_pool
+    if PDF_ANNOTATION_WORKERS <= 1:
+        return None
+    if _process_pool is None:
+        # Spawned rather than forked: a forked child would inherit the event
+        # loop and database client threads of the parent
+        _process_pool = ProcessPoolExecutor(
+            max_workers=PDF_ANNOTATION_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _process_pool
+
+
+def reset_process_pool():
+    """Stop the shared process pool, if it was started; the next use starts a new one"""
+    global _process_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False, cancel_futures=True)
+        _process_pool = None
+
+
+def shutdown_executors():
+    """Stop the shared process pool on shutdown"""
+    reset_process_pool()
@@ -1,22 +1,116 @@
 import os
 import re
+import json
+import asyncio
+import hashlib
+import logging
+from typing import List
 from mistralai import Mistral
-from groq import Groq
+from groq import AsyncGroq
 from dotenv import load_dotenv
 
+# The LLM cache below needs the database, which reads its URL at import time
+load_dotenv()
+
+from .db import db
+from .cache import TwoTierCache
+from .batcher import MicroBatcher
+from .executor import run_blocking
+from .providers import call_provider
+from .render import render_page
+from .chunking import count_tokens, split_markdown
 from .prompts import (
+    PROMPT_VERSION,
     HTML_FORMATTING_PROMPT,
     HIGHLIGHT_PROMPT,
+    BATCH_HIGHLIGHT_PROMPT,
     SEARCHABLE_SENTENCES_PROMPT,
 )
 
-load_dotenv()
+logger = logging.getLogger(__name__)
 
 MISTRAL_CLIENT = Mistral(api_key=os.getenv("MISTRAL_API_KEY"))
-GROQ_CLIENT = Groq(api_key=os.getenv("GROQ_API_KEY"))
+# Retries are handled by call_provider, so the SDK's own are turned off
+GROQ_CLIENT = AsyncGroq(api_key=os.getenv("GROQ_API_KEY"), max_retries=0)
+
+# "local" renders Markdown and places highlights in-process, "llm" asks the model
+HTML_RENDERER = os.getenv("HTML_RENDERER", "local")
+
+# Completions run at temperature 0, so they are cached by model, prompt and
+# input. LLM_CACHE_MAX_ENTRIES bounds the stored entries, LLM_CACHE_SIZE the
+# ones kept in memory.
+LLM_CACHE = TwoTierCache(
+    "llm",
+    db.llm_cache,
+    maxsize=int(os.getenv("LLM_CACHE_SIZE", "256")),
+    ttl=int(os.getenv("LLM_CACHE_TTL", str(30 * 24 * 3600))),
+    store_maxsize=int(os.getenv("LLM_CACHE_MAX_ENTRIES", "50000")),
+)
+
+
+def completion_key(model: str, system_prompt: str, content: str) -> str:
+    """
+    Content address of a completion; any change to the prompt text or
+    PROMPT_VERSION gives a new key
+    """
+    payload = json.dumps([model, PROMPT_VERSION, system_prompt, content])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+HIGHLIGHT_MODEL = "llama-3.1-8b-instant"
+
+# Pages processed at about the same time share one highlight request, up to
+# HIGHLIGHT_BATCH_TOKENS of input. Pages over half the budget go alone, and
+# a budget of 0 turns batching off.
+HIGHLIGHT_BATCH_TOKENS = int(os.getenv("HIGHLIGHT_BATCH_TOKENS", "6000"))
+HIGHLIGHT_BATCH_WINDOW = float(os.getenv("HIGHLIGHT_BATCH_WINDOW", "0.05"))
+
+# Pages longer than this are split at block boundaries and their chunks sent
+# to the LLM stages in parallel
+PAGE_CHUNK_TOKENS = int(os.getenv("PAGE_CHUNK_TOKENS", "3000"))
+
+
+async def create_completion(model: str, system_prompt: str, content: str, **kwargs) -> str:
+    """
+    Run a Groq chat completion at temperature 0, without caching
 
+    Returns: the completion text
+    """
+    response = await call_provider(
+        "groq",
+        lambda: GROQ_CLIENT.chat.completions.create(
+            model=model,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": content},
+            ],
+            temperature=0.0,
+            **kwargs,
+        ),
+    )
+    return response.choices[0].message.content
 
-def extract_data(url: str):
+
+async def complete(model: str, system_prompt: str, content: str) -> str:
+    """
+    Run a deterministic Groq chat completion, served from the LLM cache when
+    the same model, prompt and input were seen before.
+
+    Args:
+        model (str): The Groq model name
+        system_prompt (str): The system prompt
+        content (str): The user message
+
+    Returns:
+        str: The completion text
+    """
+    return await LLM_CACHE.get_or_compute(
+        completion_key(model, system_prompt, content),
+        lambda: create_completion(model, system_prompt, content),
+    )
+
+
+async def extract_data(url: str):
     """
     Extract text from a URL using Mistral OCR.
 
@@ -26,15 +120,18 @@ def extract_data(url: str):
     Returns:
         str: The extracted text from the document.
     """
-    ocr_response = MISTRAL_CLIENT.ocr.process(
-        model="mistral-ocr-latest",
-        document={"type": "document_url", "document_url": url},
-        include_image_base64=True,
+    ocr_response = await call_provider(
+        "mistral",
+        lambda: MISTRAL_CLIENT.ocr.process_async(
+            model="mistral-ocr-latest",
+            document={"type": "document_url", "document_url": url},
+            include_image_base64=True,
+        ),
     )
     return ocr_response
 
 
-def extract_highlights(content: str):
+async def extract_highlights(content: str):
     """
     Extract highlights from a given text using Groq.
 
@@ -44,18 +141,76 @@ def extract_highlights(content: str):
     Returns:
         str: The extracted highlights from the text.
     """
-    response = GROQ_CLIENT.chat.completions.create(
-        model="llama-3.1-8b-instant",
-        messages=[
-            {"role": "system", "content": HIGHLIGHT_PROMPT},
-            {"role": "user", "content": content},
-        ],
-        temperature=0.0,
+    chunks = split_markdown(content, PAGE_CHUNK_TOKENS)
+    if len(chunks) > 1:
+        highlights = await asyncio.gather(*(extract_highlights(chunk) for chunk in chunks))
+        return "\n".join(h for h in highlights if h)
+
+    if HIGHLIGHT_BATCH_TOKENS <= 0 or count_tokens(content) > HIGHLIGHT_BATCH_TOKENS // 2:
+        return await complete(HIGHLIGHT_MODEL, HIGHLIGHT_PROMPT, content)
+
+    # Cached per page, so a page is reused whichever batch it was part of
+    return await LLM_CACHE.get_or_compute(
+        completion_key(HIGHLIGHT_MODEL, BATCH_HIGHLIGHT_PROMPT, content),
+        lambda: HIGHLIGHT_BATCHER.submit(content),
     )
-    return response.choices[0].message.content
 
 
-def format_to_html(content: str, highlights: str):
+async def extract_highlights_batch(contents: List[str]) -> List[str]:
+    """
+    Extract highlights from several pages in one Groq request. Pages missing
+    from the structured response, or all of them when the request fails or
+    its response does not parse, fall back to one request per page.
+
+    Args:
+        contents (List[str]): The text of each page
+
+    Returns:
+        List[str]: The highlights of each page, one sentence per line
+    """
+    if len(contents) == 1:
+        return [await complete(HIGHLIGHT_MODEL, HIGHLIGHT_PROMPT, contents[0])]
+
+    pages = "\n\n".join(
+        f'<page id="{n}">\n{content}\n</page>' for n, content in enumerate(contents, 1)
+    )
+    highlights = {}
+    try:
+        response = await create_completion(
+            HIGHLIGHT_MODEL,
+            BATCH_HIGHLIGHT_PROMPT,
+            pages,
+            response_format={"type": "json_object"},
+        )
+        for page in json.loads(response)["pages"]:
+            sentences = page["highlights"]
+            if isinstance(sentences, list) and all(isinstance(s, str) for s in sentences):
+                highlights[int(page["page"])] = "\n".join(f"- {s}" for s in sentences)
+    except (ValueError, KeyError, TypeError) as e:
+        logger.warning(f"Unparseable batched highlights for {len(contents)} pages: {e}")
+    except Exception as e:
+        # An API error fails the pages one by one, not the whole batch
+        logger.warning(f"Batched highlights failed for {len(contents)} pages: {e!r}")
+
+    async def page_highlights(n: int, content: str) -> str:
+        if n in highlights:
+            return highlights[n]
+        return await complete(HIGHLIGHT_MODEL, HIGHLIGHT_PROMPT, content)
+
+    return await asyncio.gather(
+        *(page_highlights(n, content) for n, content in enumerate(contents, 1))
+    )
+
+
+HIGHLIGHT_BATCHER = MicroBatcher(
+    extract_highlights_batch,
+    budget=HIGHLIGHT_BATCH_TOKENS,
+    window=HIGHLIGHT_BATCH_WINDOW,
+    cost=count_tokens,
+)
+
+
+async def format_to_html(content: str, highlights: str):
     """
     Format the extracted text and highlights into HTML.
 
@@ -68,33 +223,76 @@ def format_to_html(content: str, highlights: str):
             - str: The formatted HTML with indexed highlight tags
             - dict: A dictionary mapping highlight indexes to their sentences
     """
-    response = GROQ_CLIENT.chat.completions.create(
-        model="llama-3.3-70b-versatile",
-        messages=[
-            {"role": "system", "content": HTML_FORMATTING_PROMPT},
-            {
-                "role": "user",
-                "content": f"Markdown text: {content}\n\nList of sentences to highlight: {highlights}",
-            },
-        ],
-        temperature=0.0,
+    if HTML_RENDERER != "llm":
+        # Rendering and highlight matching are CPU-bound, long pages take
+        # hundreds of milliseconds
+        return await run_blocking(render_page, content, highlights)
+
+    chunks = split_markdown(content, PAGE_CHUNK_TOKENS)
+    html_chunks = await asyncio.gather(
+        *(
+            complete(
+                "llama-3.3-70b-versatile",
+                HTML_FORMATTING_PROMPT,
+                f"Markdown text: {chunk}\n\nList of sentences to highlight: {highlights}",
+            )
+            for chunk in chunks
+        )
     )
 
-    html_content = response.choices[0].message.content
+    html_content = merge_html_chunks(html_chunks)
+    return html_content, parse_highlight_mapping(html_content)
+
 
-    # Extract highlight mapping
+def merge_html_chunks(html_chunks: List[str]) -> str:
+    """
+    Join HTML formatted chunk by chunk, renumbering highlight indexes so
+    they run in order across the whole page
+    """
+    merged = []
+    next_index = 0
+
+    for html_chunk in html_chunks:
+        renumbered = {}
+
+        def renumber(match):
+            nonlocal next_index
+            index = int(match.group(1))
+            if index not in renumbered:
+                renumbered[index] = next_index
+                next_index += 1
+            return f"<highlight index='{renumbered[index]}'>"
+
+        merged.append(re.sub(r'<highlight index=[\'"](\d+)[\'"]>', renumber, html_chunk))
+
+    return "\n".join(merged)
+
+
+def parse_highlight_mapping(html_content: str):
+    """
+    Extract the highlight mapping from HTML with indexed highlight tags.
+
+    Args:
+        html_content (str): HTML containing <highlight index='n'> tags.
+
+    Returns:
+        dict: A dictionary mapping highlight indexes to their sentences
+    """
     highlight_mapping = {}
     highlight_pattern = r'<highlight index=[\'"](\d+)[\'"]>(.*?)</highlight>'
-    matches = re.finditer(highlight_pattern, html_content)
+    matches = re.finditer(highlight_pattern, html_content, re.S)
     for match in matches:
         index = int(match.group(1))
         sentence = match.group(2)
+        # A highlight split around other tags appears as several segments
+        if index in highlight_mapping:
+            sentence = f"{highlight_mapping[index]} {sentence}"
         highlight_mapping[index] = sentence
 
-    return html_content, highlight_mapping
+    return highlight_mapping
 
 
-def extract_searchable_sentences(content: str):
+async def extract_searchable_sentences(content: str):
     """
     Extract searchable sentences from a given text using Groq.
 
@@ -104,12 +302,4 @@ def extract_searchable_sentences(content: str):
     Returns:
         str: The extracted searchable sentences from the text.
     """
-    response = GROQ_CLIENT.chat.completions.create(
-        model="llama-3.1-8b-instant",
-        messages=[
-            {"role": "system", "content": SEARCHABLE_SENTENCES_PROMPT},
-            {"role": "user", "content": content},
-        ],
-        temperature=0.0,
-    )
-    return response.choices[0].message.content
+    return await complete("llama-3.1-8b-instant", SEARCHABLE_SENTENCES_PROMPT, content)
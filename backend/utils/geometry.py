@@ -0,0 +1,125 @@
+import os
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Union
+
+import fitz
+
+from utils.matching import normalize_text, find_match
+from utils.executor import PDF_ANNOTATION_WORKERS, get_process_pool, reset_process_pool
+
+
+# Rectangles are stored as [x0, y0, x1, y1] in PDF page coordinates
+Rect = List[float]
+
+
+def _page_words(page: fitz.Page):
+    """
+    Normalized text of a page's text layer, with the word each character
+    came from
+    Returns: (text, word index per character, words)
+    """
+    words = page.get_text("words", sort=True)
+    chars, owners = [], []
+    for n, word in enumerate(words):
+        normalized = normalize_text(word[4])
+        chars.append(normalized)
+        owners.extend([n] * len(normalized))
+    return "".join(chars), owners, words
+
+
+def _line_rects(words: list) -> List[Rect]:
+    """Merge consecutive words on the same line into one rectangle each"""
+    rects, current_line = [], None
+    for x0, y0, x1, y1, _, block, line, _ in words:
+        if (block, line) == current_line:
+            rect = rects[-1]
+            rects[-1] = [min(rect[0], x0), min(rect[1], y0), max(rect[2], x1), max(rect[3], y1)]
+        else:
+            rects.append([x0, y0, x1, y1])
+            current_line = (block, line)
+    return rects
+
+
+def locate_sentences(page: fitz.Page, sentences: List[str]) -> List[List[Rect]]:
+    """
+    Find each sentence in a page's text layer, ignoring case, punctuation,
+    spacing and hyphenation, and tolerating small wording changes.
+    Returns: For each sentence, the rectangles covering it (empty when not found)
+    """
+    text, owners, words = _page_words(page)
+    taken = []
+    located = []
+
+    for sentence in sentences:
+        target = normalize_text(sentence)
+        found = find_match(text, target, taken) if target else None
+        if not found:
+            located.append([])
+            continue
+
+        taken.append(found)
+        first, last = owners[found[0]], owners[found[1] - 1]
+        located.append(_line_rects(words[first : last + 1]))
+
+    return located
+
+
+# Fewest pages worth spreading over worker processes
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "8"))
+
+
+def locate_highlights(
+    pdf: Union[bytes, str], highlights: Dict[int, List[str]]
+) -> Dict[int, List[List[Rect]]]:
+    """
+    Locate the highlights of several pages in a PDF
+    CPU-bound, run it on the blocking executor
+
+    Args:
+        pdf (bytes or str): The PDF file, or its path
+        highlights (dict): Highlight sentences by zero-based page number
+
+    Returns:
+        dict: Rectangles of every sentence by page number, for pages in the PDF
+    """
+    located = {}
+    doc = fitz.open(pdf) if isinstance(pdf, str) else fitz.open(stream=pdf, filetype="pdf")
+    with doc:
+        for page_num, sentences in highlights.items():
+            if 0 <= page_num < len(doc):
+                located[page_num] = locate_sentences(doc[page_num], sentences)
+    return located
+
+
+def locate_highlights_parallel(
+    pdf: Union[bytes, str], highlights: Dict[int, List[str]]
+) -> Dict[int, List[List[Rect]]]:
+    """
+    locate_highlights with the pages split into shards across the process
+    pool, each worker opening the document itself. Small jobs, or a disabled
+    pool, run in the calling thread. Blocks until every shard is done.
+    Pass a path rather than bytes for large files to avoid copying them to
+    every worker.
+    """
+    pool = get_process_pool()
+    if pool is None or len(highlights) < PDF_PARALLEL_MIN_PAGES:
+        return locate_highlights(pdf, highlights)
+
+    # Round-robin keeps dense runs of pages (e.g. an appendix) spread out
+    page_nums = sorted(highlights)
+    shards = [page_nums[n::PDF_ANNOTATION_WORKERS] for n in range(PDF_ANNOTATION_WORKERS)]
+    futures = [
+        pool.submit(locate_highlights, pdf, {page_num: highlights[page_num] for page_num in shard})
+        for shard in shards
+        if shard
+    ]
+
+    located = {}
+    try:
+        for future in futures:
+            located.update(future.result())
+    except BrokenProcessPool:
+        # A worker died (e.g. out of memory); start a fresh pool next time
+        reset_process_pool()
+        return locate_highlights(pdf, highlights)
+    return located
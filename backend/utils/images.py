@@ -0,0 +1,89 @@
+import base64
+import asyncio
+import hashlib
+
+from utils.db import get_image_urls, store_image_url
+from utils.cloudinary_utils import upload_to_cloudinary
+from utils.singleflight import SingleFlight
+
+
+# Images being uploaded right now, so pages sharing a figure share the upload
+_upload_flights = SingleFlight()
+
+
+def decode_image(image_base64: str) -> bytes:
+    """Decode an OCR image, with or without its data URI prefix"""
+    if image_base64.startswith("data:"):
+        image_base64 = image_base64.split(",", 1)[1]
+    return base64.b64decode(image_base64)
+
+
+def hash_images(images: list) -> dict:
+    """
+    Content hash of each OCR image that carries image data
+    Returns: Dictionary mapping image ids to the sha256 of their bytes
+    """
+    return {
+        image["id"]: hashlib.sha256(decode_image(image["image_base64"])).hexdigest()
+        for image in images
+        if image.get("image_base64")
+    }
+
+
+async def lookup_image_urls(images: list) -> dict:
+    """
+    Resolve OCR images already hosted under the same content hash, without
+    uploading anything
+    Returns: Dictionary mapping image ids to their hosted URL
+    """
+    image_hashes = hash_images(images)
+    known = await get_image_urls(list(set(image_hashes.values())))
+    return {
+        image_id: known[content_hash]
+        for image_id, content_hash in image_hashes.items()
+        if content_hash in known
+    }
+
+
+async def upload_image(content_hash: str, data: bytes) -> str:
+    """
+    Upload image bytes under their content hash and register the hosted URL
+    Returns: Hosted image URL or None
+    """
+    image_url = await upload_to_cloudinary(data, f"image_{content_hash}")
+    if image_url:
+        await store_image_url(content_hash, image_url)
+    return image_url
+
+
+async def ingest_images(images: list) -> dict:
+    """
+    Host OCR images, reusing any earlier upload of the same bytes and
+    uploading the rest concurrently
+    Returns: Dictionary mapping image ids to their hosted URL
+    """
+    image_hashes = hash_images(images)
+    image_data = {
+        image_hashes[image["id"]]: decode_image(image["image_base64"])
+        for image in images
+        if image["id"] in image_hashes
+    }
+
+    hosted = await get_image_urls(list(image_data))
+    missing = [content_hash for content_hash in image_data if content_hash not in hosted]
+    uploaded = await asyncio.gather(
+        *(
+            _upload_flights.do(
+                content_hash,
+                lambda h=content_hash: upload_image(h, image_data[h]),
+            )
+            for content_hash in missing
+        )
+    )
+    hosted.update(zip(missing, uploaded))
+
+    return {
+        image_id: hosted[content_hash]
+        for image_id, content_hash in image_hashes.items()
+        if hosted.get(content_hash)
+    }
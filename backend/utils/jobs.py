@@ -0,0 +1,133 @@
+from datetime import datetime, timedelta, timezone
+
+from pymongo import ReturnDocument
+
+from utils.db import db, get_document_id
+
+
+# Job states: queued -> running -> done, or back to queued on a retryable
+# failure until max attempts are used up and the job is marked failed
+
+
+async def ensure_job_indexes():
+    """
+    Create the indexes used to enqueue and claim jobs
+    """
+    await db.jobs.create_index("document_id", unique=True)
+    await db.jobs.create_index([("status", 1), ("visible_at", 1)])
+
+
+async def enqueue_job(url: str, requeue: bool = False):
+    """
+    Queue processing of a document, once per document
+    With requeue, a finished or failed job is queued again with fresh attempts
+    """
+    now = datetime.now(timezone.utc)
+    document_id = get_document_id(url)
+
+    await db.jobs.update_one(
+        {"document_id": document_id},
+        {
+            "$setOnInsert": {
+                "document_id": document_id,
+                "url": url,
+                "status": "queued",
+                "attempts": 0,
+                "visible_at": now,
+                "created_at": now,
+            }
+        },
+        upsert=True,
+    )
+
+    if requeue:
+        await db.jobs.update_one(
+            {"document_id": document_id, "status": {"$in": ["done", "failed"]}},
+            {
+                "$set": {"status": "queued", "attempts": 0, "visible_at": now},
+                "$unset": {"error": ""},
+            },
+        )
+
+
+async def claim_job(worker_id: str, visibility_timeout: int):
+    """
+    Claim the next visible job for a worker
+    Running jobs whose visibility timeout expired (crashed worker) are claimed again
+    Returns: Job dict or None if nothing is ready
+    """
+    now = datetime.now(timezone.utc)
+    return await db.jobs.find_one_and_update(
+        {"status": {"$in": ["queued", "running"]}, "visible_at": {"$lte": now}},
+        {
+            "$set": {
+                "status": "running",
+                "locked_by": worker_id,
+                "started_at": now,
+                "visible_at": now + timedelta(seconds=visibility_timeout),
+            },
+            "$inc": {"attempts": 1},
+        },
+        sort=[("visible_at", 1)],
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+async def extend_job(job_id, worker_id: str, visibility_timeout: int) -> bool:
+    """
+    Push back the visibility timeout of a running job
+    Returns: bool indicating if the worker still owns the job
+    """
+    result = await db.jobs.update_one(
+        {"_id": job_id, "status": "running", "locked_by": worker_id},
+        {
+            "$set": {
+                "visible_at": datetime.now(timezone.utc)
+                + timedelta(seconds=visibility_timeout)
+            }
+        },
+    )
+    return result.matched_count > 0
+
+
+async def complete_job(job_id, worker_id: str):
+    """
+    Mark a job as done
+    """
+    await db.jobs.update_one(
+        {"_id": job_id, "locked_by": worker_id},
+        {
+            "$set": {"status": "done", "finished_at": datetime.now(timezone.utc)},
+            "$unset": {"locked_by": "", "error": ""},
+        },
+    )
+
+
+async def fail_job(job: dict, worker_id: str, error: str, max_attempts: int, backoff: int):
+    """
+    Record a failed attempt, retrying with exponential backoff until
+    max_attempts is reached
+    """
+    now = datetime.now(timezone.utc)
+    if job["attempts"] >= max_attempts:
+        update = {"status": "failed", "error": error, "finished_at": now}
+    else:
+        delay = backoff * 2 ** (job["attempts"] - 1)
+        update = {
+            "status": "queued",
+            "error": error,
+            "visible_at": now + timedelta(seconds=delay),
+        }
+
+    await db.jobs.update_one(
+        {"_id": job["_id"], "locked_by": worker_id},
+        {"$set": update, "$unset": {"locked_by": ""}},
+    )
+
+
+async def get_job(url: str):
+    """
+    Retrieve the processing job of a document
+    Returns: Job dict or None if the document was never queued
+    """
+    return await db.jobs.find_one({"document_id": get_document_id(url)})
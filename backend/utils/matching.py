@@ -0,0 +1,55 @@
+import re
+import html as html_lib
+from difflib import SequenceMatcher
+from typing import List, Optional, Sequence, Tuple
+
+
+# Inline or display TeX, which never appears in a PDF text layer as written
+MATH_PATTERN = re.compile(r"(\$\$.+?\$\$|\$[^$\n]+?\$)", re.S)
+
+# Minimum similarity for a sentence that does not appear verbatim in a text
+MATCH_THRESHOLD = 0.85
+
+
+def normalize_text(text: str) -> str:
+    """Letters and digits only, lowercased, without math or HTML entities"""
+    text = MATH_PATTERN.sub("", html_lib.unescape(text))
+    return "".join(ch.lower() for ch in text if ch.isalnum())
+
+
+def find_match(
+    text: str, target: str, taken: Sequence[Tuple[int, int]] = ()
+) -> Optional[Tuple[int, int]]:
+    """
+    Locate a normalized target in a normalized text, exactly or by
+    similarity, outside the spans already taken
+    Returns: (start, end) in text, or None
+    """
+
+    def free(start: int, end: int) -> bool:
+        return all(end <= used_start or start >= used_end for used_start, used_end in taken)
+
+    start = text.find(target)
+    while start != -1:
+        if free(start, start + len(target)):
+            return start, start + len(target)
+        start = text.find(target, start + 1)
+
+    matcher = SequenceMatcher(None, text, target, autojunk=False)
+    block = matcher.find_longest_match(0, len(text), 0, len(target))
+    if block.size < len(target) * 0.3:
+        return None
+
+    # Align the target around its longest common run, with some slack for
+    # words the LLM added or dropped, then trim to what actually matched
+    slack = len(target) // 5
+    offset = max(0, block.a - block.b - slack)
+    window = text[offset : block.a - block.b + len(target) + slack]
+    blocks: List = [
+        b for b in SequenceMatcher(None, window, target, autojunk=False).get_matching_blocks() if b.size
+    ]
+    start, end = offset + blocks[0].a, offset + blocks[-1].a + blocks[-1].size
+    ratio = 2 * sum(b.size for b in blocks) / (len(target) + end - start)
+    if ratio >= MATCH_THRESHOLD and free(start, end):
+        return start, end
+    return None
@@ -1,3 +1,7 @@
+# Part of every LLM cache key; bump it to drop cached completions when the
+# prompts change in a way their text alone does not capture
+PROMPT_VERSION = "1"
+
 HTML_FORMATTING_PROMPT = """
 You are an expert highlight writer and HTML formatter. Your task is to highlight important statements or sentences and structure the provided Markdown text into valid, properly formatted HTML.
 
@@ -56,3 +60,23 @@ You are an expert in identifying searchable content — sentences that represent
 - A list of integers representing the indexes of the best searchable sentences. Example: [0, 4, 5, 7, 9]
 - Strictly follow this format. Do not add any other text or commentary.
 """
+
+
+BATCH_HIGHLIGHT_PROMPT = """
+You are an expert in reading and analyzing research and technical papers. Your task is to identify and highlight important statements or sentences from several pages of a paper.
+
+**You will be provided with:**
+- Several pages, each wrapped in <page id="n"> and </page> tags.
+
+**Guidelines to Follow**:
+- Treat each page separately. Pick out only those statements or sentences on that page that are important, critical, or contribute significantly to the understanding of the paper. Pick maximum 10 sentences per page.
+- Keep each sentence exactly as it is written in the text — do not rephrase, rewrite, or change any part of the sentence.
+- Never move a sentence to a different page than the one it appears on.
+- A page with nothing worth highlighting (a title page, a reference list, only figures) gets an empty list.
+- DANGER DANGER DANGER: Do not highlight any paper references or mathematical equations.
+
+**Output Format**:
+- A JSON object with one entry per page, in the same order as the pages. Example:
+  {"pages": [{"page": 1, "highlights": ["First sentence.", "Second sentence."]}, {"page": 2, "highlights": []}]}
+- Strictly follow this format. Do not add any other text or commentary.
+"""
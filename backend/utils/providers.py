@@ -0,0 +1,321 @@
+import os
+import time
+import random
+import asyncio
+import logging
+from email.utils import parsedate_to_datetime
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import groq
+import httpx
+from cloudinary.exceptions import (
+    AlreadyExists,
+    AuthorizationRequired,
+    BadRequest,
+    Error as CloudinaryError,
+    NotAllowed,
+    NotFound,
+    RateLimited,
+)
+
+logger = logging.getLogger(__name__)
+
+
+# Default number of in-flight calls allowed per external provider.
+# Each can be overridden with <PROVIDER>_CONCURRENCY, e.g. GROQ_CONCURRENCY=8
+DEFAULT_CONCURRENCY = {
+    "mistral": 2,
+    "groq": 4,
+    "serper": 10,
+    "youtube": 10,
+    "cloudinary": 5,
+}
+
+# Default requests per second (<PROVIDER>_RATE, 0 for no limit)
+DEFAULT_RATE = {
+    "mistral": 1,
+    "groq": 10,
+    "serper": 20,
+    "youtube": 20,
+    "cloudinary": 10,
+}
+
+# Default seconds one call may take (<PROVIDER>_TIMEOUT)
+DEFAULT_TIMEOUT = {
+    "mistral": 300,
+    "groq": 60,
+    "serper": 15,
+    "youtube": 10,
+    "cloudinary": 60,
+}
+
+# Retries of a failed call, with exponential backoff between attempts
+PROVIDER_MAX_RETRIES = int(os.getenv("PROVIDER_MAX_RETRIES", "4"))
+PROVIDER_BACKOFF_BASE = float(os.getenv("PROVIDER_BACKOFF_BASE", "1"))
+PROVIDER_BACKOFF_MAX = float(os.getenv("PROVIDER_BACKOFF_MAX", "60"))
+
+# Consecutive failures that open a provider's circuit, and how long it stays
+# open before a trial call is let through
+BREAKER_THRESHOLD = int(os.getenv("BREAKER_THRESHOLD", "5"))
+BREAKER_COOLDOWN = float(os.getenv("BREAKER_COOLDOWN", "30"))
+
+RETRYABLE_STATUS = {408, 425, 500, 502, 503, 504}
+THROTTLED_STATUS = {420, 429}
+
+# Cloudinary errors for requests that would fail again; the SDK raises the
+# base Error for connection failures and unexpected server responses
+CLOUDINARY_FATAL = (AlreadyExists, AuthorizationRequired, BadRequest, NotAllowed, NotFound)
+
+
+class ProviderUnavailable(Exception):
+    """Raised without calling a provider whose circuit is open"""
+
+
+def get_concurrency(provider: str) -> int:
+    """Return the configured concurrency limit for a provider"""
+    value = os.getenv(f"{provider.upper()}_CONCURRENCY")
+    if value:
+        return max(1, int(value))
+    return DEFAULT_CONCURRENCY[provider]
+
+
+class TokenBucket:
+    """Allow `rate` calls per second on average, with bursts of `burst`"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def take(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class AdaptiveLimiter:
+    """
+    Concurrency limit that backs off when the provider throttles us: halved
+    on every throttled call, grown by one per limit's worth of successes,
+    up to the configured maximum
+    """
+
+    def __init__(self, max_limit: int):
+        self.max_limit = max_limit
+        self.limit = float(max_limit)
+        self.in_flight = 0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self) -> None:
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def release(self) -> None:
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def on_success(self) -> None:
+        self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+    def on_throttled(self) -> None:
+        self.limit = max(1.0, self.limit / 2)
+
+
+class CircuitBreaker:
+    """
+    Fail fast after `threshold` consecutive failures, then let a single
+    trial call through every `cooldown` seconds until one succeeds
+    """
+
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+
+    def allow(self) -> bool:
+        if self.opened_at is None:
+            return True
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            # Half-open: this call is the trial, the rest wait another cooldown
+            self.opened_at = time.monotonic()
+            return True
+        return False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+
+
+def _status_code(error: Exception) -> Optional[int]:
+    for source in (error, getattr(error, "response", None), getattr(error, "raw_response", None)):
+        status_code = getattr(source, "status_code", None)
+        if isinstance(status_code, int):
+            return status_code
+    return None
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    """Seconds the provider asked us to wait, from a Retry-After header"""
+    for source in (getattr(error, "response", None), getattr(error, "raw_response", None)):
+        headers = getattr(source, "headers", None)
+        value = headers.get("retry-after") if headers is not None else None
+        if not value:
+            continue
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            pass
+    return None
+
+
+def classify(error: Exception) -> str:
+    """
+    Returns: "throttled" for rate limiting, "retryable" for transient
+    failures (timeouts, connection errors, 5xx), "fatal" otherwise
+    """
+    if isinstance(error, RateLimited):
+        return "throttled"
+    if isinstance(error, CloudinaryError):
+        return "fatal" if isinstance(error, CLOUDINARY_FATAL) else "retryable"
+
+    status_code = _status_code(error)
+    if status_code in THROTTLED_STATUS:
+        return "throttled"
+    if status_code in RETRYABLE_STATUS:
+        return "retryable"
+    if status_code is not None:
+        return "fatal"
+
+    if isinstance(
+        error,
+        (
+            asyncio.TimeoutError,
+            ConnectionError,
+            httpx.TransportError,
+            groq.APIConnectionError,
+        ),
+    ):
+        return "retryable"
+    return "fatal"
+
+
+class Provider:
+    """Rate limit, concurrency limit, timeout, retries and circuit breaker of one provider"""
+
+    def __init__(self, name: str):
+        self.name = name
+        prefix = name.upper()
+
+        rate = float(os.getenv(f"{prefix}_RATE", str(DEFAULT_RATE[name])))
+        self.bucket = TokenBucket(rate, max(1.0, rate)) if rate > 0 else None
+        self.limiter = AdaptiveLimiter(get_concurrency(name))
+        self.breaker = CircuitBreaker(BREAKER_THRESHOLD, BREAKER_COOLDOWN)
+        self.timeout = float(os.getenv(f"{prefix}_TIMEOUT", str(DEFAULT_TIMEOUT[name])))
+        self.stats = {"calls": 0, "retries": 0, "throttled": 0, "failures": 0, "rejected": 0}
+
+    async def _attempt(self, fn: Callable[[], Awaitable[Any]], blocking: bool) -> Any:
+        if self.bucket:
+            await self.bucket.take()
+
+        await self.limiter.acquire()
+        try:
+            if blocking:
+                # Cancelling the wait would not stop the thread, which
+                # would keep its executor slot; the call times out itself
+                return await fn()
+            return await asyncio.wait_for(fn(), timeout=self.timeout)
+        finally:
+            await self.limiter.release()
+
+    async def call(self, fn: Callable[[], Awaitable[Any]], blocking: bool = False) -> Any:
+        self.stats["calls"] += 1
+
+        for attempt in range(PROVIDER_MAX_RETRIES + 1):
+            if not self.breaker.allow():
+                self.stats["rejected"] += 1
+                raise ProviderUnavailable(f"{self.name} is unavailable, circuit open")
+
+            try:
+                result = await self._attempt(fn, blocking)
+            except Exception as e:
+                kind = classify(e)
+                if kind == "throttled":
+                    self.stats["throttled"] += 1
+                    self.limiter.on_throttled()
+                elif kind == "retryable":
+                    self.breaker.record_failure()
+
+                if kind == "fatal" or attempt == PROVIDER_MAX_RETRIES:
+                    self.stats["failures"] += 1
+                    raise
+
+                # Full jitter, unless the provider said how long to wait
+                delay = retry_after(e)
+                if delay is None:
+                    delay = random.uniform(0, PROVIDER_BACKOFF_BASE * 2**attempt)
+                delay = min(delay, PROVIDER_BACKOFF_MAX)
+
+                self.stats["retries"] += 1
+                logger.warning(
+                    f"{self.name} call failed ({kind}: {e!r}), retry {attempt + 1} in {delay:.1f}s"
+                )
+                await asyncio.sleep(delay)
+            else:
+                self.breaker.record_success()
+                self.limiter.on_success()
+                return result
+
+    def report(self) -> dict:
+        """Call counters and current limits of the provider"""
+        return {
+            **self.stats,
+            "concurrency_limit": int(self.limiter.limit),
+            "circuit_open": self.breaker.opened_at is not None,
+        }
+
+
+_providers: Dict[str, Provider] = {}
+
+
+def get_provider(provider: str) -> Provider:
+    if provider not in _providers:
+        _providers[provider] = Provider(provider)
+    return _providers[provider]
+
+
+async def call_provider(
+    provider: str, fn: Callable[[], Awaitable[Any]], blocking: bool = False
+) -> Any:
+    """
+    Call an external provider through its shared limits, retrying transient
+    failures. fn is called once per attempt and must return a new awaitable.
+    Use as `await call_provider("groq", lambda: client.create(...))`.
+    Pass blocking=True when fn runs in a thread; it must then enforce the
+    provider timeout itself.
+    """
+    return await get_provider(provider).call(fn, blocking)
+
+
+def provider_stats() -> dict:
+    """Report of every provider called so far"""
+    return {name: provider.report() for name, provider in _providers.items()}
@@ -0,0 +1,353 @@
+import re
+import html as html_lib
+from typing import Dict, List, Optional, Tuple
+
+from utils.matching import MATH_PATTERN, normalize_text, find_match
+
+
+# Pieces of rendered HTML that are not plain text: tags, math and entities
+TOKEN_PATTERN = re.compile(r"<[^>]+>|\$\$.+?\$\$|\$[^$\n]+?\$|&#?\w+;", re.S)
+
+HEADING_PATTERN = re.compile(r"^(#{1,6})\s+(.*?)\s*#*$")
+LIST_PATTERN = re.compile(r"^(\s*)([-*+]|\d+[.)])\s+(.*)$")
+TABLE_SEPARATOR_PATTERN = re.compile(r"^\|?\s*:?-{3,}:?\s*(\|\s*:?-{3,}:?\s*)*\|?$")
+RULE_PATTERN = re.compile(r"^(-{3,}|\*{3,}|_{3,})$")
+SCHEME_PATTERN = re.compile(r"^([a-z][a-z0-9+.-]*):", re.I)
+
+# Highlights shorter than this (in letters and digits) are too ambiguous to place
+MIN_HIGHLIGHT_LENGTH = 10
+
+
+def _escape(text: str) -> str:
+    return html_lib.escape(text, quote=False)
+
+
+def _attribute(text: str) -> str:
+    """Escape already escaped text for use inside a quoted attribute"""
+    return html_lib.escape(html_lib.unescape(text), quote=True)
+
+
+def _safe_url(url: str) -> Optional[str]:
+    """
+    Attribute value of an http(s) or relative link target, None for any
+    other scheme such as javascript:
+    """
+    url = html_lib.unescape(url)
+    # Browsers ignore control characters and whitespace inside the scheme
+    scheme = SCHEME_PATTERN.match(re.sub(r"[\x00-\x20]", "", url))
+    if scheme and scheme.group(1).lower() not in ("http", "https"):
+        return None
+    return html_lib.escape(url, quote=True)
+
+
+def _render_image(match: re.Match) -> str:
+    src = _safe_url(match.group(2))
+    if src is None:
+        return match.group(1)
+    return f'<img src="{src}" alt="{_attribute(match.group(1))}">'
+
+
+def _render_link(match: re.Match, keep) -> str:
+    href = _safe_url(match.group(2))
+    if href is None:
+        return match.group(1)
+    return keep(f'<a href="{href}">') + match.group(1) + keep("</a>")
+
+
+def render_inline(text: str) -> str:
+    """
+    Render inline Markdown (code, images, links, bold, italic) to HTML,
+    leaving TeX math as is
+    """
+    rendered = []
+    for n, part in enumerate(MATH_PATTERN.split(text)):
+        if n % 2:
+            rendered.append(_escape(part))
+            continue
+
+        # Stash spans whose content must not be touched by emphasis rules
+        stash = []
+
+        def keep(markup: str) -> str:
+            stash.append(markup)
+            return f"\x00{len(stash) - 1}\x00"
+
+        part = _escape(part)
+        part = re.sub(r"`([^`]+)`", lambda m: keep(f"<code>{m.group(1)}</code>"), part)
+        part = re.sub(r"!\[([^\]]*)\]\(([^)\s]+)\)", lambda m: keep(_render_image(m)), part)
+        part = re.sub(r"\[([^\]]+)\]\(([^)\s]+)\)", lambda m: _render_link(m, keep), part)
+        part = re.sub(r"\*\*(.+?)\*\*|__(.+?)__", lambda m: f"<strong>{m.group(1) or m.group(2)}</strong>", part)
+        part = re.sub(r"(?<![\w*])\*(?![\s*])(.+?)(?<![\s*])\*(?![\w*])", r"<em>\1</em>", part)
+        part = re.sub(r"(?<![\w_])_(?![\s_])(.+?)(?<![\s_])_(?![\w_])", r"<em>\1</em>", part)
+        part = re.sub(r"\x00(\d+)\x00", lambda m: stash[int(m.group(1))], part)
+        rendered.append(part)
+
+    return "".join(rendered)
+
+
+def _split_row(line: str) -> List[str]:
+    line = line.strip()
+    if line.startswith("|"):
+        line = line[1:]
+    if line.endswith("|"):
+        line = line[:-1]
+    return [cell.strip() for cell in line.split("|")]
+
+
+def _render_table(lines: List[str]) -> str:
+    header, rows = _split_row(lines[0]), [_split_row(line) for line in lines[2:]]
+    head = "".join(f"<th>{render_inline(cell)}</th>" for cell in header)
+    body = "".join(
+        "<tr>" + "".join(f"<td>{render_inline(cell)}</td>" for cell in row) + "</tr>"
+        for row in rows
+    )
+    return f"<table><thead><tr>{head}</tr></thead><tbody>{body}</tbody></table>"
+
+
+def _render_list(lines: List[str]) -> str:
+    """Render list items, nesting them by indentation"""
+    html = []
+    stack = []  # (indent, tag) of open lists
+    item = 0  # position of the last item in html
+
+    for line in lines:
+        match = LIST_PATTERN.match(line)
+        if not match:
+            # Continuation of the last item
+            html[item] = html[item][: -len("</li>")] + " " + render_inline(line.strip()) + "</li>"
+            continue
+
+        indent = len(match.group(1).expandtabs(4))
+        tag = "ol" if match.group(2)[0].isdigit() else "ul"
+
+        # Close nested lists down to the one this item belongs to; an item
+        # indented between two levels stays in the deeper list
+        while len(stack) > 1 and indent <= stack[-2][0]:
+            html.append(f"</{stack.pop()[1]}>")
+            html.append("</li>")
+        if not stack or indent > stack[-1][0]:
+            if stack:
+                # Open the nested list inside the previous item
+                html[item] = html[item][: -len("</li>")]
+            stack.append((indent, tag))
+            html.append(f"<{tag}>")
+
+        item = len(html)
+        html.append(f"<li>{render_inline(match.group(3))}</li>")
+
+    while stack:
+        _, tag = stack.pop()
+        html.append(f"</{tag}>")
+        if stack:
+            html.append("</li>")
+
+    return "".join(html)
+
+
+def _starts_block(lines: List[str], i: int) -> bool:
+    stripped = lines[i].strip()
+    return bool(
+        not stripped
+        or stripped.startswith(("```", "$$", ">"))
+        or HEADING_PATTERN.match(stripped)
+        or LIST_PATTERN.match(lines[i])
+        or RULE_PATTERN.match(stripped)
+        or (
+            stripped.startswith("|")
+            and i + 1 < len(lines)
+            and TABLE_SEPARATOR_PATTERN.match(lines[i + 1].strip())
+        )
+    )
+
+
+def render_markdown(markdown: str) -> str:
+    """
+    Render OCR Markdown (headings, paragraphs, lists, tables, code, quotes
+    and math) to HTML
+    """
+    lines = markdown.split("\n")
+    html = []
+    i = 0
+
+    while i < len(lines):
+        stripped = lines[i].strip()
+
+        if not stripped:
+            i += 1
+
+        elif stripped.startswith("```"):
+            code = []
+            i += 1
+            while i < len(lines) and not lines[i].strip().startswith("```"):
+                code.append(lines[i])
+                i += 1
+            i += 1
+            html.append(f"<pre><code>{_escape(chr(10).join(code))}</code></pre>")
+
+        elif stripped.startswith("$$"):
+            block = [stripped]
+            i += 1
+            if len(stripped) == 2 or not stripped.endswith("$$"):
+                while i < len(lines):
+                    block.append(lines[i].strip())
+                    i += 1
+                    if block[-1].endswith("$$"):
+                        break
+            html.append(f"<p>{_escape(chr(10).join(block))}</p>")
+
+        elif HEADING_PATTERN.match(stripped):
+            match = HEADING_PATTERN.match(stripped)
+            level = len(match.group(1))
+            html.append(f"<h{level}>{render_inline(match.group(2))}</h{level}>")
+            i += 1
+
+        elif RULE_PATTERN.match(stripped):
+            html.append("<hr>")
+            i += 1
+
+        elif (
+            stripped.startswith("|")
+            and i + 1 < len(lines)
+            and TABLE_SEPARATOR_PATTERN.match(lines[i + 1].strip())
+        ):
+            table = []
+            while i < len(lines) and lines[i].strip().startswith("|"):
+                table.append(lines[i])
+                i += 1
+            html.append(_render_table(table))
+
+        elif LIST_PATTERN.match(lines[i]):
+            items = []
+            while i < len(lines) and lines[i].strip():
+                if items and not LIST_PATTERN.match(lines[i]) and _starts_block(lines, i):
+                    break
+                items.append(lines[i])
+                i += 1
+            html.append(_render_list(items))
+
+        elif stripped.startswith(">"):
+            quote = []
+            while i < len(lines) and lines[i].strip().startswith(">"):
+                quote.append(lines[i].strip()[1:].strip())
+                i += 1
+            html.append(f"<blockquote>{render_markdown(chr(10).join(quote))}</blockquote>")
+
+        else:
+            paragraph = [stripped]
+            i += 1
+            while i < len(lines) and not _starts_block(lines, i):
+                paragraph.append(lines[i].strip())
+                i += 1
+            html.append(f"<p>{render_inline(' '.join(paragraph))}</p>")
+
+    return "\n".join(html)
+
+
+def parse_highlight_sentences(highlights: str) -> List[str]:
+    """
+    Split the highlight list returned by the LLM into sentences, dropping
+    bullets, numbering, quotes and introductory lines
+    """
+    sentences = []
+    for line in highlights.split("\n"):
+        line = re.sub(r"^\s*(?:[-*•]|\d+[.)])\s+", "", line).strip()
+        line = line.strip("\"'“”")
+        if not line or line.endswith(":"):
+            continue
+        sentences.append(line)
+    return sentences
+
+
+def _text_view(html: str) -> Tuple[str, List[Tuple[int, int]], List[Tuple[int, int]]]:
+    """
+    Normalized text of rendered HTML with the HTML span of every character,
+    plus the spans (tags, math) a highlight tag must never split
+    """
+    chars, spans, opaque = [], [], []
+
+    def collect(start: int, end: int):
+        for offset in range(start, end):
+            if html[offset].isalnum():
+                chars.append(html[offset].lower())
+                spans.append((offset, offset + 1))
+
+    position = 0
+    for match in TOKEN_PATTERN.finditer(html):
+        collect(position, match.start())
+        token = match.group()
+        if token.startswith("&"):
+            char = html_lib.unescape(token)
+            if len(char) == 1 and char.isalnum():
+                chars.append(char.lower())
+                spans.append((match.start(), match.end()))
+        else:
+            opaque.append((match.start(), match.end()))
+        position = match.end()
+    collect(position, len(html))
+
+    return "".join(chars), spans, opaque
+
+
+def inject_highlights(html: str, sentences: List[str]) -> Tuple[str, Dict[int, str]]:
+    """
+    Wrap each sentence found in rendered HTML in <highlight index='n'> tags.
+    Matching ignores case, whitespace, punctuation and markup, and tolerates
+    small wording changes. A match spanning tags or math is wrapped piece by
+    piece so the HTML stays well-formed.
+    Returns: (html, highlight_mapping) with indexes in sentence order
+    """
+    text, spans, opaque = _text_view(html)
+    taken = []
+    insertions = []
+    highlight_mapping = {}
+
+    for sentence in sentences:
+        target = normalize_text(sentence)
+        if len(target) < MIN_HIGHLIGHT_LENGTH:
+            continue
+
+        found = find_match(text, target, taken)
+        if not found:
+            continue
+        taken.append(found)
+
+        index = len(highlight_mapping)
+        start, end = spans[found[0]][0], spans[found[1] - 1][1]
+        while end < len(html) and html[end] in ".,;:!?)":
+            end += 1
+
+        # Split the match around tags and math, wrapping each text piece
+        pieces = []
+        position = start
+        for opaque_start, opaque_end in opaque:
+            if opaque_end <= start or opaque_start >= end:
+                continue
+            pieces.append((position, opaque_start))
+            position = opaque_end
+        pieces.append((position, end))
+
+        matched_text = []
+        for piece_start, piece_end in pieces:
+            if not html[piece_start:piece_end].strip():
+                continue
+            insertions.append((piece_start, f"<highlight index='{index}'>"))
+            insertions.append((piece_end, "</highlight>"))
+            matched_text.append(html_lib.unescape(html[piece_start:piece_end]))
+
+        highlight_mapping[index] = " ".join(" ".join(matched_text).split())
+
+    # Insert from the end so earlier offsets stay valid, closing tags before
+    # opening ones where two highlights touch
+    insertions.sort(key=lambda item: (item[0], not item[1].startswith("</")), reverse=True)
+    for offset, markup in insertions:
+        html = html[:offset] + markup + html[offset:]
+
+    return html, highlight_mapping
+
+
+def render_page(markdown: str, highlights: str) -> Tuple[str, Dict[int, str]]:
+    """
+    Render a page of OCR Markdown to HTML with its highlights tagged
+    Returns: (html, highlight_mapping)
+    """
+    return inject_highlights(render_markdown(markdown), parse_highlight_sentences(highlights))
@@ -0,0 +1,46 @@
+import itertools
+from typing import Dict, Iterable, Optional
+
+
+# Priority tiers, lower runs first
+REQUESTED = 0
+READ_AHEAD = 1
+BACKLOG = 2
+
+
+class PageQueue:
+    """
+    Pending pages of one document ordered by priority.
+    Pages a reader asked for come first (most recent request wins), then the
+    read-ahead window after them, then the rest of the document in page order.
+    """
+
+    def __init__(self, page_numbers: Iterable[int], read_ahead: int):
+        self._pending: Dict[int, tuple] = {
+            page_number: (BACKLOG, 0, page_number) for page_number in page_numbers
+        }
+        self._read_ahead = read_ahead
+        self._counter = itertools.count(1)
+
+    def prioritize(self, page_number: int) -> None:
+        """Move a requested page and its read-ahead window to the front"""
+        # Newer requests get a smaller sequence so they sort first in their tier
+        sequence = -next(self._counter)
+
+        if page_number in self._pending:
+            self._pending[page_number] = (REQUESTED, sequence, page_number)
+
+        for ahead in range(page_number + 1, page_number + 1 + self._read_ahead):
+            if ahead in self._pending and self._pending[ahead][0] >= READ_AHEAD:
+                self._pending[ahead] = (READ_AHEAD, sequence, ahead)
+
+    def pop(self) -> Optional[int]:
+        """Remove and return the most urgent page number, None when empty"""
+        if not self._pending:
+            return None
+        page_number = min(self._pending, key=self._pending.get)
+        del self._pending[page_number]
+        return page_number
+
+    def __len__(self) -> int:
+        return len(self._pending)
@@ -1,13 +1,36 @@
 import os
 import re
-import json
-import base64
-import requests
-import concurrent.futures
-from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import asyncio
+import httpx
 from typing import Literal, Dict, Any, List, Union
 
+from utils.db import db, get_thumbnail_urls, store_thumbnail_url
+from utils.cache import TwoTierCache
+from utils.singleflight import SingleFlight
 from utils.cloudinary_utils import upload_to_cloudinary
+from utils.http_client import get_http_client
+from utils.providers import call_provider
+
+
+# Search results are shared across pages and documents for SEARCH_CACHE_TTL
+# seconds, with the SEARCH_CACHE_SIZE most recent queries kept in memory
+SEARCH_CACHE = TwoTierCache(
+    "search",
+    db.search_cache,
+    maxsize=int(os.getenv("SEARCH_CACHE_SIZE", "1024")),
+    ttl=int(os.getenv("SEARCH_CACHE_TTL", str(7 * 24 * 3600))),
+)
+
+
+# Thumbnails being hosted right now, so concurrent searches share the work
+_thumbnail_flights = SingleFlight()
+
+
+def normalize_query(query: str) -> str:
+    """Normalize a query so trivially different phrasings share a cache entry"""
+    query = re.sub(r"\s+", " ", query).strip().lower()
+    return query.strip(".,;:!?\"'()[]")
 
 
 def extract_youtube_video_id(url: str) -> str:
@@ -24,25 +47,84 @@ def extract_youtube_video_id(url: str) -> str:
     return None
 
 
-def get_hd_thumbnail_base64(video_id: str) -> str:
-    """Get HD thumbnail as base64 encoded string"""
+async def get_hd_thumbnail(video_id: str) -> bytes:
+    """Get HD thumbnail image bytes"""
+    client = get_http_client()
+
     url = f"https://img.youtube.com/vi/{video_id}/maxresdefault.jpg"
-    response = requests.get(url)
+    response = await call_provider("youtube", lambda: client.get(url))
 
     if response.status_code == 200:
-        return base64.b64encode(response.content).decode("utf-8")
+        return response.content
 
     # Fall back to medium quality if HD not available
     url = f"https://img.youtube.com/vi/{video_id}/mqdefault.jpg"
-    response = requests.get(url)
+    response = await call_provider("youtube", lambda: client.get(url))
 
     if response.status_code == 200:
-        return base64.b64encode(response.content).decode("utf-8")
+        return response.content
 
     return None
 
 
-def serper_search(
+async def host_thumbnail(video_id: str) -> str:
+    """
+    Download a video thumbnail, upload it to Cloudinary and register its URL
+    Returns: Hosted thumbnail URL or None
+    """
+    thumbnail = await get_hd_thumbnail(video_id)
+    if not thumbnail:
+        return None
+
+    # Upload image to Cloudinary
+    cloudinary_img_url = await upload_to_cloudinary(thumbnail, f"video_{video_id}")
+    if cloudinary_img_url:
+        await store_thumbnail_url(video_id, cloudinary_img_url)
+    return cloudinary_img_url
+
+
+async def get_thumbnail_urls_for(video_ids: list) -> dict:
+    """
+    Resolve hosted thumbnails for videos, checking the registry before any
+    network call and fetching the unknown ones concurrently
+    Returns: Dictionary mapping video ids to their thumbnail URL
+    """
+    thumbnail_urls = await get_thumbnail_urls(video_ids)
+
+    missing = [video_id for video_id in video_ids if video_id not in thumbnail_urls]
+    hosted = await asyncio.gather(
+        *(
+            _thumbnail_flights.do(video_id, lambda v=video_id: host_thumbnail(v))
+            for video_id in missing
+        )
+    )
+    thumbnail_urls.update(zip(missing, hosted))
+    return thumbnail_urls
+
+
+async def serper_search(
+    query: str,
+    search_type: Literal["search", "videos"] = "search",
+) -> Union[Dict[Any, Any], List[Dict[str, str]]]:
+    """
+    Perform a search using the Serper API, served from the search cache
+    when the same normalized query was searched recently.
+
+    Args:
+        query (str): The search query
+        search_type (str): Type of search - either "search" or "videos"
+
+    Returns:
+        Union[dict, list]: Formatted results, see fetch_serper_results
+    """
+    normalized = normalize_query(query)
+    key = f"{search_type}:{hashlib.sha1(normalized.encode()).hexdigest()}"
+    return await SEARCH_CACHE.get_or_compute(
+        key, lambda: fetch_serper_results(query, search_type)
+    )
+
+
+async def fetch_serper_results(
     query: str,
     search_type: Literal["search", "videos"] = "search",
 ) -> Union[Dict[Any, Any], List[Dict[str, str]]]:
@@ -66,7 +148,7 @@ def serper_search(
         if search_type == "videos"
         else query
     )
-    payload = json.dumps({"q": base_query})
+    payload = {"q": base_query}
 
     headers = {
         "X-API-KEY": os.getenv("SERPER_API_KEY"),
@@ -74,30 +156,32 @@ def serper_search(
     }
 
     try:
-        response = requests.post(url, headers=headers, data=payload)
-        response.raise_for_status()
+        async def post():
+            response = await get_http_client().post(url, headers=headers, json=payload)
+            response.raise_for_status()
+            return response
+
+        response = await call_provider("serper", post)
         result = response.json()
 
         # Format video results if search_type is videos
         if search_type == "videos" and "videos" in result:
             formatted_videos = []
             if "videos" in result:
-                for video in result["videos"][:5]:  # Get top 5 videos
-                    video_id = extract_youtube_video_id(video.get("link", ""))
-                    cloudinary_img_url = None
-                    if video_id:
-                        thumbnail_base64 = get_hd_thumbnail_base64(video_id)
-
-                        # Upload image to Cloudinary
-                        cloudinary_img_url = upload_to_cloudinary(
-                            thumbnail_base64, f"video_{video_id}"
-                        )
-
+                videos = result["videos"][:5]  # Get top 5 videos
+                video_ids = [
+                    extract_youtube_video_id(video.get("link", "")) for video in videos
+                ]
+                thumbnail_urls = await get_thumbnail_urls_for(
+                    list({video_id for video_id in video_ids if video_id})
+                )
+
+                for video, video_id in zip(videos, video_ids):
                     formatted_video = {
                         "title": video.get("title", ""),
                         "link": video.get("link", ""),
                         "duration": video.get("duration", ""),
-                        "image_url": cloudinary_img_url,
+                        "image_url": thumbnail_urls.get(video_id),
                     }
                     formatted_videos.append(formatted_video)
             return formatted_videos
@@ -116,13 +200,13 @@ def serper_search(
             return formatted_results
 
         return result
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         raise Exception(f"Search request failed: {str(e)}")
 
 
-def prepare_resources(highlight_mapping: dict):
+async def prepare_resources(highlight_mapping: dict):
     """
-    Prepare resources for search based on highlight mapping, running searches in parallel.
+    Prepare resources for search based on highlight mapping, running searches concurrently.
 
     Args:
         highlight_mapping (dict): A dictionary mapping highlight indexes to their sentences
@@ -130,27 +214,20 @@ def prepare_resources(highlight_mapping: dict):
     Returns:
         dict: A dictionary of resources indexed by highlight index
     """
-    resources = {}
 
-    def search_both_types(sentence):
-        """Helper function to perform both search types for a sentence in parallel"""
-        with ThreadPoolExecutor() as inner_executor:
-            article_future = inner_executor.submit(serper_search, sentence, "search")
-            video_future = inner_executor.submit(serper_search, sentence, "videos")
-
-            # Wait for both to complete and return results
-            return article_future.result(), video_future.result()
-
-    # Use ThreadPoolExecutor to run searches in parallel
-    with ThreadPoolExecutor() as executor:
-        future_to_index = {
-            executor.submit(search_both_types, sentence): index
-            for index, sentence in highlight_mapping.items()
-        }
-
-        for future in concurrent.futures.as_completed(future_to_index):
-            index = future_to_index[future]
-            articles, videos = future.result()
-            resources[index] = {"articles": articles, "videos": videos}
+    async def search_both_types(sentence):
+        """Helper function to perform both search types for a sentence concurrently"""
+        return await asyncio.gather(
+            serper_search(sentence, "search"), serper_search(sentence, "videos")
+        )
+
+    indexes = list(highlight_mapping.keys())
+    results = await asyncio.gather(
+        *(search_both_types(highlight_mapping[index]) for index in indexes)
+    )
+
+    resources = {}
+    for index, (articles, videos) in zip(indexes, results):
+        resources[index] = {"articles": articles, "videos": videos}
 
     return resources
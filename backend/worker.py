@@ -0,0 +1,109 @@
+import os
+import asyncio
+import logging
+from dotenv import load_dotenv
+
+# Load environment variables before the modules below read them
+load_dotenv()
+
+from api.pipeline import WORKER_ID, process_document
+from utils.db import ensure_indexes, set_document_status
+from utils.jobs import (
+    ensure_job_indexes,
+    claim_job,
+    extend_job,
+    complete_job,
+    fail_job,
+)
+from utils.cloudinary_utils import init_cloudinary
+from utils.http_client import close_http_client
+from utils.executor import shutdown_executors
+
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+# Seconds a claimed job stays invisible to other workers without a heartbeat
+VISIBILITY_TIMEOUT = int(os.getenv("JOB_VISIBILITY_TIMEOUT", "300"))
+
+# Attempts before a job is marked as failed
+MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+
+# Base delay in seconds before a failed job is retried, doubled per attempt
+RETRY_BACKOFF = int(os.getenv("JOB_RETRY_BACKOFF", "30"))
+
+# Seconds to wait before polling again when the queue is empty
+POLL_INTERVAL = float(os.getenv("WORKER_POLL_INTERVAL", "2"))
+
+# Documents processed at once by one worker process
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "2"))
+
+
+async def keep_job_visible(job: dict):
+    """Extend the visibility timeout of a job until cancelled"""
+    while True:
+        await asyncio.sleep(VISIBILITY_TIMEOUT / 3)
+        if not await extend_job(job["_id"], WORKER_ID, VISIBILITY_TIMEOUT):
+            logger.warning(f"Lost job for {job['url']}")
+            return
+
+
+async def run_job(job: dict):
+    """Process the document of a claimed job and record the outcome"""
+    heartbeat = asyncio.create_task(keep_job_visible(job))
+    try:
+        await process_document(job["url"])
+        await complete_job(job["_id"], WORKER_ID)
+        logger.info(f"Finished {job['url']}")
+    except Exception as e:
+        logger.error(f"Job for {job['url']} failed: {str(e)}")
+        await fail_job(job, WORKER_ID, str(e), MAX_ATTEMPTS, RETRY_BACKOFF)
+        if job["attempts"] >= MAX_ATTEMPTS:
+            await set_document_status(job["url"], "failed", error=str(e))
+    finally:
+        heartbeat.cancel()
+
+
+async def run_worker_loop():
+    """Claim and process one job at a time until cancelled"""
+    while True:
+        try:
+            job = await claim_job(WORKER_ID, VISIBILITY_TIMEOUT)
+        except Exception as e:
+            logger.error(f"Failed to claim job: {str(e)}")
+            job = None
+
+        if job is None:
+            await asyncio.sleep(POLL_INTERVAL)
+            continue
+
+        logger.info(f"Processing {job['url']} (attempt {job['attempts']})")
+        try:
+            await run_job(job)
+        except Exception as e:
+            # The job stays claimed and is picked up again once its
+            # visibility timeout runs out
+            logger.error(f"Failed to record outcome of {job['url']}: {str(e)}")
+
+
+async def run_worker():
+    """Run WORKER_CONCURRENCY job loops in this process"""
+    await asyncio.gather(*(run_worker_loop() for _ in range(WORKER_CONCURRENCY)))
+
+
+async def main():
+    init_cloudinary()
+    await ensure_indexes()
+    await ensure_job_indexes()
+    try:
+        await run_worker()
+    finally:
+        await close_http_client()
+        shutdown_executors()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -30,6 +30,7 @@ interface ProcessedPaperData {
   content?: string;
   total_pages?: number;
   page: {
+    index?: number;
     content: string;
     images?: Array<{
       id: string;
@@ -75,11 +76,13 @@ export default function AnnotationPage() {
   const [currentPageNumber, setCurrentPageNumber] = useState(1);
   const [displayError, setDisplayError] = useState<string | null>(null);
   const mainContentRef = useRef<HTMLDivElement>(null);
+  // Resources fetched on demand, keyed by "<page>:<highlight index>"
+  const [fetchedResources, setFetchedResources] = useState<Record<string, { articles: Resource[]; videos: Resource[] }>>({});
 
   // Process resources to handle both regular video arrays and search parameter objects
   const processResources = (index: string) => {
     if (!processedPaperData?.page?.resources || !processedPaperData.page.resources[index]) {
-      return { articles: [], videos: [] };
+      return fetchedResources[`${processedPaperData?.page?.index}:${index}`] || { articles: [], videos: [] };
     }
 
     const resourceData = processedPaperData.page.resources[index];
@@ -93,6 +96,47 @@ export default function AnnotationPage() {
     };
   };
 
+  // Resources are searched when a highlight is opened, not with the page
+  useEffect(() => {
+    const pageNumber = processedPaperData?.page?.index;
+    if (!selectedHighlight || !currentUrl || !pageNumber) return;
+    if (processedPaperData?.page?.resources?.[selectedHighlight]) return;
+
+    const key = `${pageNumber}:${selectedHighlight}`;
+    if (fetchedResources[key]) return;
+
+    const fetchResources = async () => {
+      try {
+        const response = await fetch(`${process.env.NEXT_PUBLIC_BACKEND_API_URL}/api/resources`, {
+          method: 'POST',
+          headers: {
+            'Content-Type': 'application/json',
+          },
+          body: JSON.stringify({
+            url: currentUrl,
+            page_number: pageNumber,
+            highlight_index: Number(selectedHighlight),
+          }),
+        });
+        if (!response.ok) return;
+
+        const result = await response.json();
+        const resourceData = result.data.resources;
+        setFetchedResources((current) => ({
+          ...current,
+          [key]: {
+            articles: resourceData.articles || [],
+            videos: Array.isArray(resourceData.videos) ? resourceData.videos : [],
+          },
+        }));
+      } catch (error) {
+        console.error('Error fetching resources:', error);
+      }
+    };
+
+    fetchResources();
+  }, [selectedHighlight, currentUrl, processedPaperData, fetchedResources]);
+
   // Handle initial data loading
   useEffect(() => {
     const loadInitialData = () => {
@@ -207,21 +251,19 @@ const handleDownload = async () => {
   try {
     setIsDownloading(true);
     setDisplayError(null);
-    const response = await fetch(`${process.env.NEXT_PUBLIC_BACKEND_API_URL}/pdf/download`, {
-      method: 'POST',
-      headers: {
-        'accept': 'application/json',
-        'Content-Type': 'application/json',
-      },
-      body: JSON.stringify({ pdf_url: currentUrl }),
-    });
+    // The highlighted PDF is streamed straight back instead of going
+    // through a hosted copy first
+    const params = new URLSearchParams({ url: currentUrl });
+    const response = await fetch(
+      `${process.env.NEXT_PUBLIC_BACKEND_API_URL}/pdf/download/stream?${params}`,
+      { headers: { 'accept': 'application/pdf' } }
+    );
     if (response.ok) {
-      const result = await response.json();
-      if (result.status === 'success' && result.data.pdf_url) {
-        window.open(result.data.pdf_url, '_blank');
-      } else {
-        console.error('Failed to download PDF');
-      }
+      const blob = await response.blob();
+      const objectUrl = URL.createObjectURL(blob);
+      window.open(objectUrl, '_blank');
+      // Give the new tab time to load the document before releasing it
+      setTimeout(() => URL.revokeObjectURL(objectUrl), 60000);
     } else {
       console.error('Failed to download PDF');
     }
@@ -93,7 +93,8 @@ export const PaperContent: React.FC<PaperContentProps> = ({ content, images, onH
     let processedContent = htmlContent;
     
     // Process images
-    imageData.forEach(image => {
+    // Images still being uploaded have no URL yet and keep their placeholder
+    imageData.filter(image => image.image_url).forEach(image => {
       const regex = new RegExp(`src=["']${image.id}["']`, 'g');
       processedContent = processedContent.replace(regex, `src="${image.image_url}"`);
     });
@@ -1,4 +1,15 @@
-import { useState, useEffect, useCallback } from 'react';
+import { useState, useEffect, useCallback, useRef } from 'react';
+
+// How long to wait for the stream to deliver a page before polling for it
+const STREAM_WAIT_MS = 60000;
+const POLL_INTERVAL_MS = 3000;
+const MAX_POLLS = 40;
+
+class StreamClosedError extends Error {}
+
+type Waiter = { resolve: (payload: any) => void; reject: (error: Error) => void };
+
+const sleep = (ms: number) => new Promise((resolve) => setTimeout(resolve, ms));
 
 export const useExtraction = () => {
   const [loading, setLoading] = useState(false);
@@ -32,26 +43,140 @@ export const useExtraction = () => {
     }
   }, [currentUrl]);
 
+  // Pages pushed by the backend stream, keyed by page number
+  const pagesRef = useRef<Record<number, any>>({});
+  // Callers waiting for a page that is still being processed
+  const waitersRef = useRef<Record<number, Waiter>>({});
+
+  const rejectWaiters = (error: Error) => {
+    const waiters = waitersRef.current;
+    waitersRef.current = {};
+    Object.values(waiters).forEach((waiter) => waiter.reject(error));
+  };
+
+  // Keep one stream of processed pages open per document instead of polling
+  useEffect(() => {
+    pagesRef.current = {};
+    if (!currentUrl) return;
+
+    const source = new EventSource(
+      `${process.env.NEXT_PUBLIC_BACKEND_API_URL}/api/extract/stream?url=${encodeURIComponent(currentUrl)}`
+    );
+    source.addEventListener('page', (event) => {
+      const payload = JSON.parse((event as MessageEvent).data);
+      const pageNumber = payload.page.index;
+      pagesRef.current[pageNumber] = payload;
+
+      const waiter = waitersRef.current[pageNumber];
+      if (waiter) {
+        delete waitersRef.current[pageNumber];
+        waiter.resolve(payload);
+      }
+
+      // Refresh the page on screen when an updated version arrives,
+      // e.g. once its images are uploaded
+      setData((current: any) =>
+        current?.data?.page?.index === pageNumber && current.data.etag !== payload.etag
+          ? { ...current, data: payload }
+          : current
+      );
+    });
+    source.addEventListener('done', () => {
+      source.close();
+      rejectWaiters(new StreamClosedError('Stream ended before the page arrived'));
+    });
+    source.addEventListener('failed', (event) => {
+      source.close();
+      const { detail } = JSON.parse((event as MessageEvent).data);
+      rejectWaiters(new Error(detail || 'Failed to process document'));
+    });
+    // The browser reconnects on its own, waiters poll in the meantime
+    source.onerror = () => rejectWaiters(new StreamClosedError('Stream connection lost'));
+
+    return () => {
+      source.close();
+      rejectWaiters(new StreamClosedError('Stream closed'));
+    };
+  }, [currentUrl]);
+
+  const waitForPage = (pageNumber: number) => {
+    if (pagesRef.current[pageNumber]) {
+      return Promise.resolve(pagesRef.current[pageNumber]);
+    }
+    return new Promise<any>((resolve, reject) => {
+      const waiter: Waiter = {
+        resolve: (payload) => {
+          clearTimeout(timer);
+          resolve(payload);
+        },
+        reject: (error) => {
+          clearTimeout(timer);
+          reject(error);
+        },
+      };
+      const timer = setTimeout(() => {
+        if (waitersRef.current[pageNumber] === waiter) {
+          delete waitersRef.current[pageNumber];
+        }
+        reject(new StreamClosedError('Timed out waiting for the stream'));
+      }, STREAM_WAIT_MS);
+      waitersRef.current[pageNumber] = waiter;
+    });
+  };
+
+  const requestPage = async (url: string, pageNumber: number) => {
+    const response = await fetch(`${process.env.NEXT_PUBLIC_BACKEND_API_URL}/api/extract`, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+      },
+      body: JSON.stringify({ url, page_number: pageNumber }),
+    });
+
+    if (!response.ok) {
+      const errorData = await response.json();
+      throw new Error(errorData.detail || 'Failed to process request');
+    }
+    return { status: response.status, body: await response.json() };
+  };
+
+  // Fallback when the stream cannot deliver the page
+  const pollPage = async (url: string, pageNumber: number) => {
+    for (let attempt = 0; attempt < MAX_POLLS; attempt++) {
+      const { status, body } = await requestPage(url, pageNumber);
+      if (status !== 202) return body;
+      await sleep(POLL_INTERVAL_MS);
+    }
+    throw new Error('Timed out waiting for the page to be processed');
+  };
+
   // Common fetch function to avoid duplication
   const fetchData = async (url: string, pageNumber: number = 1, isPageChange: boolean = false) => {
     try {
       setLoading(true);
       setError(null);
 
-      const response = await fetch(`${process.env.NEXT_PUBLIC_BACKEND_API_URL}/api/extract`, {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json',
-        },
-        body: JSON.stringify({ url, page_number: pageNumber }),
-      });
-
-      if (!response.ok) {
-        const errorData = await response.json();
-        throw new Error(errorData.detail || 'Failed to process request');
+      // Pages already pushed by the stream need no request at all
+      const streamed = isPageChange ? pagesRef.current[pageNumber] : null;
+      if (streamed) {
+        const streamedData = { status: 'success', message: 'Retrieved from stream', data: streamed };
+        setData({ ...streamedData, isPageChange });
+        return streamedData;
       }
 
-      const fetchedData = await response.json();
+      const { status, body } = await requestPage(url, pageNumber);
+
+      let fetchedData = body;
+      if (status === 202) {
+        // The request moved the page up the queue, the stream delivers it
+        try {
+          const payload = await waitForPage(pageNumber);
+          fetchedData = { status: 'success', message: 'Retrieved from stream', data: payload };
+        } catch (err) {
+          if (!(err instanceof StreamClosedError)) throw err;
+          fetchedData = await pollPage(url, pageNumber);
+        }
+      }
       setData({ ...fetchedData, isPageChange });
       return fetchedData;
     } catch (err) {